@@ -0,0 +1,79 @@
+"""
+Benchmarks the search page extractors.
+
+    python benchmarks/bench_extract.py [saved-search-page.html ...]
+
+Without arguments the saved search pages in benchmarks/fixtures/ are used, plus a large
+synthetic page. Save more with e.g.
+`curl https://letterboxd.com/s/search/films/young+mr+lincoln/ > benchmarks/fixtures/search-young-mr-lincoln.html`.
+Reports mean parse time and peak allocated memory per lookup for each available backend,
+and flags backends whose result differs from bs4's, the original implementation.
+"""
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractors import EXTRACTORS, lxml
+
+ROUNDS = 50
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'search-*.html')
+
+
+def synthetic_page(results=20, padding=2000):
+    head = '<html><head><meta charset="utf-8"><title>Search</title></head><body>'
+    nav = '<nav><ul class="nav">' + ''.join(f'<li><a href="/n{i}/">Item {i}</a></li>' for i in range(50)) + '</ul></nav>'
+    filler = '<div class="filler">' + ''.join(f'<p>Lorem ipsum {i}<br/></p>' for i in range(padding)) + '</div>'
+    items = ''.join(
+        f'<li><div class="film-detail-content"><h2 class="headline-2 prettify">'
+        f'<span class="film-title-wrapper"><a href="/film/film-{i}/">Film {i} <small class="metadata">'
+        f'<a href="/films/year/19{i % 100:02d}/">19{i % 100:02d}</a></small></a></span></h2>'
+        f'<p class="film-metadata">Directed by <a href="/director/d/">Someone</a></p></div></li>'
+        for i in range(results)
+    )
+    return head + nav + f'<ul class="results">{items}</ul>' + filler + '</body></html>'
+
+
+def bench(name, extract, html):
+    extract(html)
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        result = extract(html)
+    elapsed = (time.perf_counter() - start) / ROUNDS
+
+    tracemalloc.start()
+    extract(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'  {name:<8} {elapsed * 1000:8.3f} ms  {peak / 1024:10.1f} KiB peak  -> {result}')
+    return result
+
+
+def main():
+    paths = sys.argv[1:]
+    pages = [(os.path.basename(path), open(path, encoding='utf-8').read()) for path in paths or sorted(glob.glob(FIXTURES))]
+    if not paths:
+        pages.append(('synthetic', synthetic_page()))
+    mismatches = 0
+    for label, html in pages:
+        print(f'{label} ({len(html) / 1024:.1f} KiB)')
+        expected = None
+        for name, extract in EXTRACTORS.items():
+            if name == 'lxml' and lxml is None:
+                print(f'  {name:<8} skipped, not installed')
+                continue
+            result = bench(name, extract, html)
+            if name == 'bs4':
+                expected = result
+            elif result != expected:
+                mismatches += 1
+                print(f'  {name:<8} MISMATCH, bs4 gave {expected}')
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Times FilmRaffle.build_ring with a realistic amount of constraints.
+
+    python benchmarks/bench_pairing.py
+
+Every run forbids the pairings of the last HISTORY_ROUNDS random rounds plus a couple of
+exclusions per hundred users, the way fr-roll does.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from raffle import FilmRaffle, ring_pairs
+
+SIZES = [100, 10_000, 100_000]
+HISTORY_ROUNDS = 3
+
+
+def constraints(users, rng):
+    forbidden = set()
+    for _ in range(HISTORY_ROUNDS):
+        past = users[:]
+        rng.shuffle(past)
+        forbidden.update(ring_pairs(past))
+    for _ in range(len(users) // 50):
+        a, b = rng.sample(users, 2)
+        forbidden.update([(a, b), (b, a)])
+    return forbidden
+
+
+def main():
+    rng = random.Random(1)
+    print(f'{"users":>8} {"forbidden":>10} {"time":>10} {"violations":>11}')
+    for n in SIZES:
+        users = list(range(n))
+        forbidden = constraints(users, rng)
+        engine = FilmRaffle(forbidden, rng=rng)
+        start = time.perf_counter()
+        ring, violations = engine.build_ring(users)
+        elapsed = time.perf_counter() - start
+        assert sorted(ring) == users
+        print(f'{n:>8} {len(forbidden):>10} {elapsed * 1000:>7.1f} ms {violations:>11}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Times Database.add_raffle_entries against the old ORM add_all path.
+
+    python benchmarks/bench_raffle_writes.py [DATABASE_URL]
+
+Defaults to an in-memory SQLite database (needs aiosqlite). Point it at a scratch
+Postgres/CockroachDB database to get numbers for production, every run creates and
+clears its own guild.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete
+
+from db import Database, Raffle
+
+SIZES = [100, 1000, 10000]
+BENCH_GUILD_ID = 1
+
+
+def ring(n):
+    return [(i, (i + 1) % n) for i in range(n)]
+
+
+async def orm_add_all(db, pairs):
+    async with db.Session() as session:
+        session.add_all([
+            Raffle(guild_id=BENCH_GUILD_ID, sender_id=s, receiver_id=r)
+            for s, r in pairs
+        ])
+        await session.commit()
+
+
+async def clear(db):
+    async with db.Session() as session:
+        await session.execute(delete(Raffle).filter_by(guild_id=BENCH_GUILD_ID))
+        await session.commit()
+
+
+async def main(url):
+    db = Database(url)
+    await db.init()
+    if await db.get_guild_state(BENCH_GUILD_ID) is None:
+        await db.add_guild(BENCH_GUILD_ID)
+    for user_id in range(max(SIZES)):
+        await db.admit_user(BENCH_GUILD_ID, user_id)
+
+    print(f'{"pairs":>8} {"orm add_all":>14} {"bulk insert":>14}')
+    for n in SIZES:
+        pairs = ring(n)
+        timings = []
+        for write in (orm_add_all, lambda db, pairs: db.add_raffle_entries(BENCH_GUILD_ID, pairs)):
+            await clear(db)
+            start = time.perf_counter()
+            await write(db, pairs)
+            timings.append(time.perf_counter() - start)
+        await clear(db)
+        print(f'{n:>8} {timings[0] * 1000:>11.1f} ms {timings[1] * 1000:>11.1f} ms')
+    await db.Engine.dispose()
+
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else 'sqlite+aiosqlite:///:memory:'
+    asyncio.run(main(url))
@@ -0,0 +1,77 @@
+"""
+Checks and times lb_bot's rating lookup against saved review pages.
+
+    python benchmarks/bench_rating.py
+
+Feeds each page in benchmarks/fixtures/review-*.html through lb_bot._read_rating the way
+aiohttp delivers it, in RATING_CHUNK_SIZE chunks and in small ones so matches straddle
+chunk boundaries, and compares the result with the rating the page owner gave. Also
+checks an unrated copy of each page gives None.
+"""
+import asyncio
+import glob
+import itertools
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lb_bot
+from lb_bot import _read_rating
+
+ROUNDS = 200
+CHUNK_SIZES = [lb_bot.RATING_CHUNK_SIZE, 100]
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'review-*.html')
+# page -> rating in half stars
+EXPECTED = {
+    'review-vnki-my-own-private-idaho.html': 8,
+}
+
+
+class _Content:
+    def __init__(self, page):
+        self.page = page
+        self.offset = 0
+
+    async def read(self, n):
+        chunk = self.page[self.offset:self.offset + n]
+        self.offset += len(chunk)
+        return chunk
+
+
+class _Response:
+    def __init__(self, page):
+        self.content = _Content(page)
+
+
+async def read(page):
+    resp = _Response(page)
+    rating = await _read_rating(resp)
+    return rating, resp.content.offset
+
+
+async def main():
+    failures = 0
+    for path in sorted(glob.glob(FIXTURES)):
+        name = os.path.basename(path)
+        page = open(path, 'rb').read()
+        unrated = re.sub(rb'<span class="rating rating-large[^"]*">[^<]*</span>', b'', page)
+        cases = [(name, page, EXPECTED.get(name)), (f'{name}, unrated', unrated, None)]
+        for (label, body, expected), chunk_size in itertools.product(cases, CHUNK_SIZES):
+            lb_bot.RATING_CHUNK_SIZE = chunk_size
+            start = time.perf_counter()
+            for _ in range(ROUNDS):
+                rating, consumed = await read(body)
+            elapsed = (time.perf_counter() - start) / ROUNDS
+            ok = rating == expected
+            failures += not ok
+            print(f'{label}: rating={rating} expected={expected} {"ok" if ok else "FAIL"}, '
+                  f'read {consumed}/{len(body)} bytes in chunks of {chunk_size}, {elapsed * 1e6:.0f} us')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -2,6 +2,7 @@ from discord.ext import commands
 import discord
 
 from decorators import privileged, only_in_debug_channel
+from messaging import send_packed
 
 
 class Usercontrol(commands.Cog):
@@ -46,11 +47,32 @@ class Usercontrol(commands.Cog):
         List the banned users.
         """
         naughty_list = await self.db.get_naughtly_list(ctx.guild.id)
-        message = '**__Naughty list__**\n'
+        lines = ['**__Naughty list__**']
         for user in naughty_list:
-            discord_user = ctx.guild.get_member(int(user.user_id))
-            message += f'{discord_user.mention}'
+            # raw mention, works even if they left the server
+            line = f'<@{user.user_id}>'
             if user.reason:
-                message += ": " + user.reason
-            message += '\n'
-        await ctx.channel.send(message)
+                line += ": " + user.reason
+            lines.append(line)
+        await send_packed(ctx.channel, lines, embed=True)
+
+    @commands.command(name='fr-exclude')
+    @privileged()
+    @only_in_debug_channel()
+    async def exclude(self, ctx, member: discord.Member, other: discord.Member):
+        """
+        Never pair two users with each other. !fr-exclude @user @other
+        """
+        await self.db.add_pair_exclusion(ctx.guild.id, member.id, other.id)
+        await ctx.channel.send(f"{member.mention} and {other.mention} won't be paired with each other.")
+
+    @commands.command(name='fr-unexclude')
+    @privileged()
+    @only_in_debug_channel()
+    async def unexclude(self, ctx, member: discord.Member, other: discord.Member):
+        """
+        Undo !fr-exclude. !fr-unexclude @user @other
+        """
+        await self.db.remove_pair_exclusion(ctx.guild.id, member.id, other.id)
+        await self.db.remove_pair_exclusion(ctx.guild.id, other.id, member.id)
+        await ctx.channel.send(f"{member.mention} and {other.mention} can be paired again.")
@@ -9,6 +9,8 @@ CONFIG["GUILD"] = {
     "all-recs-channel-id": int(os.getenv('RAFFLE_CHANNEL_ID')),
     "debug-channel-id": int(os.getenv('RAFFLE_DEBUG_CHANNEL_ID', 0)),
     "privileged-roles": [int(id_) for id_ in os.getenv('PRIVILEGED_ROLES').split(',')],
+    # rolls avoid repeating pairings from this many previous rounds
+    "pairing-history-rounds": int(os.getenv('PAIRING_HISTORY_ROUNDS', 3)),
 }
 
 CONFIG["CHAT"] = {
@@ -49,8 +51,84 @@ CONFIG["BOT"] = {
     "bot-token": os.getenv("BOT_TOKEN"),
 }
 
+CONFIG["DM"] = {
+    # number of DMs in flight at once
+    "workers": int(os.getenv('DM_WORKERS', 5)),
+    "retries": int(os.getenv('DM_RETRIES', 3)),
+}
+
+CONFIG["ROLES"] = {
+    # role changes in flight at once during bulk jobs
+    "concurrency": int(os.getenv('ROLE_CONCURRENCY', 5)),
+    "retries": int(os.getenv('ROLE_RETRIES', 3)),
+}
+
+CONFIG["REACTIONS"] = {
+    # seconds to wait for more signup reaction events from the same user before acting
+    "coalesce-window": float(os.getenv('REACTION_COALESCE_WINDOW', 2.0)),
+    # reactions handled at once per guild
+    "workers": int(os.getenv('REACTION_WORKERS', 4)),
+    # queued reactions per guild before new ones get deferred
+    "max-backlog": int(os.getenv('REACTION_MAX_BACKLOG', 200)),
+}
+
+CONFIG["MIA"] = {
+    # user lookups in flight at once when naming MIA users
+    "resolve-concurrency": int(os.getenv('MIA_RESOLVE_CONCURRENCY', 5)),
+}
+
+CONFIG["MEMBERS"] = {
+    # 'full' caches every member of the server, 'raffle' only the ones the raffle needs
+    # and requests others on demand, see members.py
+    "cache-policy": os.getenv('MEMBER_CACHE_POLICY', 'full'),
+    # seconds between dropping members the raffle no longer needs, with the 'raffle' policy
+    "prune-interval": int(os.getenv('MEMBER_PRUNE_INTERVAL', 600)),
+}
+
+CONFIG["LETTERBOXD"] = {
+    # max open connections to letterboxd
+    "connection-limit": int(os.getenv('LB_CONNECTION_LIMIT', 20)),
+    # total timeout for a request in seconds
+    "timeout": int(os.getenv('LB_TIMEOUT', 15)),
+    # resolved film titles kept in memory, and how long (in seconds) before they are re-fetched
+    "title-cache-size": int(os.getenv('LB_TITLE_CACHE_SIZE', 2048)),
+    "title-cache-ttl": int(os.getenv('LB_TITLE_CACHE_TTL', 7 * 24 * 3600)),
+    # search page parser: stream, lxml (needs lxml installed) or bs4
+    "html-extractor": os.getenv('LB_HTML_EXTRACTOR', 'stream'),
+    # review lookups in flight at once for dump-recs-reviews
+    "review-concurrency": int(os.getenv('LB_REVIEW_CONCURRENCY', 8)),
+    "review-retries": int(os.getenv('LB_REVIEW_RETRIES', 3)),
+    # fetch ratings for the backup csv, otherwise only check that the review exists with a
+    # HEAD request. Ratings need a GET per review, on a fresh connection each time.
+    "review-ratings": os.getenv('LB_REVIEW_RATINGS', 'false').lower() == 'true',
+}
+
+CONFIG["EXPORT"] = {
+    # compression for dump-recs attachments: none, gzip or zip
+    "compression": os.getenv('EXPORT_COMPRESSION', 'none'),
+    # attachments are split into parts no bigger than this (in bytes)
+    "part-size": int(os.getenv('EXPORT_PART_SIZE', 8 * 1024 * 1024)),
+}
+
 CONFIG["DATABASE_URL"] = os.getenv("DATABASE_URL")
 
+CONFIG["DATABASE_POOL"] = {
+    "pool-size": int(os.getenv('DB_POOL_SIZE', 5)),
+    "max-overflow": int(os.getenv('DB_MAX_OVERFLOW', 10)),
+    "pre-ping": os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    # seconds after which a connection is replaced
+    "recycle": int(os.getenv('DB_POOL_RECYCLE', 1800)),
+    # asyncpg prepared statements cached per connection
+    "statement-cache-size": int(os.getenv('DB_STATEMENT_CACHE_SIZE', 500)),
+    # run on every new connection, separated by ';'. The defaults are for cockroach.
+    "session-settings": [
+        setting.strip() for setting in os.getenv(
+            'DB_SESSION_SETTINGS',
+            'SET multiple_active_portals_enabled = true;SET autocommit_before_ddl = true',
+        ).split(';') if setting.strip()
+    ],
+}
+
 CONFIG["DATABASE"] = {
     "db-username": os.getenv('DB_USERNAME'),
     "db-password": os.getenv('DB_PASSWORD'),
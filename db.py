@@ -1,12 +1,30 @@
-from sqlalchemy import create_engine, Column, Text, ForeignKey, select, insert, update, delete, or_, Boolean
+from sqlalchemy import create_engine, func, Column, Text, BigInteger, Integer, ForeignKey, Index, select, insert, update, delete, or_, and_, Boolean, DateTime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.sql import text
 from sqlalchemy.orm import relationship, backref, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 
+import asyncio
 import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+import migrations
 logger = logging.getLogger('raffle_bot.db')
 
+# ids per IN (...) query, keeps the bind parameter count well under driver limits
+IN_CHUNK_SIZE = 500
+
+# rows per executemany batch of the bulk inserts
+INSERT_CHUNK_SIZE = 1000
+
+# session of the active unit_of_work, see Database.unit_of_work
+_current_session = ContextVar('_current_session', default=None)
+
 
 Base = declarative_base()
 
@@ -14,83 +32,288 @@ Base = declarative_base()
 class User(Base):
     __tablename__ = "User"
 
-    user_id = Column(Text, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
     lb_username = Column(Text, unique=True, nullable=True)
     note = Column(Text, nullable=True)
 
 class Guild(Base):
     __tablename__ = 'Guild'
 
-    guild_id = Column(Text, primary_key=True)
-    raffle_message_id = Column(Text, nullable=True)
+    guild_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    raffle_message_id = Column(BigInteger, nullable=True)
     raffle_rolled = Column(Boolean, default=False)
 
 
 class Raffle(Base):
     __tablename__ = "Raffle"
 
-    sender_id = Column(Text, ForeignKey('User.user_id'), primary_key=True)
-    receiver_id = Column(Text, ForeignKey('User.user_id'), primary_key=True)
-    guild_id = Column(Text, ForeignKey('Guild.guild_id'))
+    sender_id = Column(BigInteger, ForeignKey('User.user_id'), primary_key=True, autoincrement=False)
+    receiver_id = Column(BigInteger, ForeignKey('User.user_id'), primary_key=True, autoincrement=False)
+    guild_id = Column(BigInteger, ForeignKey('Guild.guild_id'))
     recomm = Column(Text, nullable=True)
     recomm_identifier = Column(Text, nullable=True)
+    # place in the ring, ordering by it walks the ring from sender to receiver.
+    # Not necessarily contiguous, rerolls leave gaps.
+    position = Column(Integer, nullable=True)
 
     sender = relationship("User", foreign_keys=[
                           sender_id], backref=backref("given_recomm", uselist=False), lazy='subquery')
     receiver = relationship("User", foreign_keys=[receiver_id], backref=backref(
         "received_recomm", uselist=False), lazy='subquery')
 
+    __table_args__ = (
+        # get_raffle_entry_by_sender, recomm_movie
+        Index('ix_raffle_guild_sender', 'guild_id', 'sender_id'),
+        # get_raffle_entry_by_receiver
+        Index('ix_raffle_guild_receiver', 'guild_id', 'receiver_id'),
+        # get_all_reccs, in ring order
+        Index('ix_raffle_guild_position', 'guild_id', 'position'),
+    )
+
     def __repr__(self):
         return f'RaffleEntry<sender_id={self.sender_id} receiver_id={self.receiver_id} recomm="{self.recomm}">'
 
+
 class NaughtyList(Base):
     __tablename__ = 'NaughtyList'
 
-    user_id = Column(Text, ForeignKey('User.user_id'), primary_key=True)
-    guild_id = Column(Text, ForeignKey('Guild.guild_id'), primary_key=True)
+    user_id = Column(BigInteger, ForeignKey('User.user_id'), primary_key=True, autoincrement=False)
+    guild_id = Column(BigInteger, ForeignKey('Guild.guild_id'), primary_key=True, autoincrement=False)
     reason = Column(Text, nullable=True)
 
+    __table_args__ = (
+        Index('ix_naughtylist_guild', 'guild_id'),
+    )
+
+
+class RaffleHistory(Base):
+    """Pairings of past rounds, so new rolls can avoid repeating them"""
+    __tablename__ = 'RaffleHistory'
+
+    guild_id = Column(BigInteger, ForeignKey('Guild.guild_id'), primary_key=True, autoincrement=False)
+    round = Column(Integer, primary_key=True, autoincrement=False)
+    sender_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    receiver_id = Column(BigInteger, nullable=False)
+
+
+class PairExclusion(Base):
+    """A user who must never be paired with another, in either direction"""
+    __tablename__ = 'PairExclusion'
+
+    guild_id = Column(BigInteger, ForeignKey('Guild.guild_id'), primary_key=True, autoincrement=False)
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    excluded_id = Column(BigInteger, primary_key=True, autoincrement=False)
+
+
+class RoleTask(Base):
+    """Pending role change of a bulk job, see roles.RoleScheduler"""
+    __tablename__ = 'RoleTask'
+
+    guild_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    role_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    # 'add' or 'remove'
+    action = Column(Text, nullable=False)
+
+
+class SchemaVersion(Base):
+    """Single row table holding the version of the last migration applied, see migrations.py"""
+    __tablename__ = 'SchemaVersion'
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+
+
+class FilmTitle(Base):
+    """Resolved Letterboxd search results, keyed by normalized query"""
+    __tablename__ = 'FilmTitle'
+
+    query = Column(Text, primary_key=True)
+    title = Column(Text, nullable=False)
+    url = Column(Text, nullable=False)
+    fetched_at = Column(DateTime, nullable=False)
+
+
+@dataclass
+class GuildState:
+    """
+    In-process copy of the Guild row fields needed on hot paths (reactions, command gates)
+    """
+    guild_id: int
+    raffle_message_id: int = None
+    raffle_rolled: bool = False
+
 
 class Database:
     Session = None
     Engine = None
     engine_url = None
 
-    def __init__(self, engine_url, debug=False):
+    def __init__(self, engine_url, debug=False, pool=None):
         self.engine_url = engine_url
+        # see CONFIG["DATABASE_POOL"] for the keys
+        self.pool = pool or {}
+        # guild_id -> GuildState, or None for guilds known not to be in the db.
+        # Kept current by every method that writes to the Guild table.
+        self._guild_states = {}
+
+    def _engine_options(self):
+        url = make_url(self.engine_url)
+        options = {}
+        if url.get_backend_name() == 'sqlite':
+            return options
+        for key, option in [('pool-size', 'pool_size'), ('max-overflow', 'max_overflow'),
+                            ('pre-ping', 'pool_pre_ping'), ('recycle', 'pool_recycle')]:
+            if key in self.pool:
+                options[option] = self.pool[key]
+        if url.get_driver_name() == 'asyncpg' and 'statement-cache-size' in self.pool:
+            options['connect_args'] = {'prepared_statement_cache_size': self.pool['statement-cache-size']}
+        return options
 
     async def init(self):
         # echo=True in the meanwhile for debugging
-        self.Engine = create_async_engine(self.engine_url)
+        self.Engine = create_async_engine(self.engine_url, **self._engine_options())
+
+        session_settings = self.pool.get('session-settings', [])
+        if session_settings and self.Engine.dialect.name != 'sqlite':
+            # every pooled connection gets these, not just the one running migrations
+            @event.listens_for(self.Engine.sync_engine, 'connect')
+            def apply_session_settings(dbapi_connection, connection_record):
+                # outside a transaction, or the rollback on return to the pool undoes them
+                autocommit = dbapi_connection.autocommit
+                dbapi_connection.autocommit = True
+                cursor = dbapi_connection.cursor()
+                for setting in session_settings:
+                    cursor.execute(setting)
+                cursor.close()
+                dbapi_connection.autocommit = autocommit
 
         async with self.Engine.begin() as conn:
-            # for cockroach
-            await conn.execute(text("SET multiple_active_portals_enabled = true"))
-            await conn.execute(text("SET autocommit_before_ddl = true"))
-            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(migrations.upgrade, Base.metadata)
 
         self.Session = sessionmaker(
             bind=self.Engine, expire_on_commit=False, class_=AsyncSession)
+        await self.load_guild_states()
+        await self.warm_pool(self.pool.get('pool-size', 0))
+
+    async def warm_pool(self, connections):
+        """Opens `connections` connections up front so the first busy command doesn't pay for it"""
+        if connections <= 0 or self.Engine.dialect.name == 'sqlite':
+            return
+
+        async def checkout():
+            async with self.Engine.connect() as conn:
+                await conn.execute(text('SELECT 1'))
+
+        # concurrent checkouts can't share a connection, so this opens that many
+        await asyncio.gather(*(checkout() for _ in range(connections)))
+        logger.info(f'warmed {connections} database connections')
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """
+        Runs every Database call made inside the block on one session and transaction,
+        committed when the block exits and rolled back if it raises.
+
+            async with db.unit_of_work():
+                entry = await db.get_raffle_entry_by_sender(guild_id, user_id)
+                await db.recomm_movie(guild_id, user_id, title, url)
+
+        Nested blocks join the outer one. The session is shared through a context variable,
+        so don't run Database calls concurrently (gather, create_task) inside the block.
+        """
+        if _current_session.get() is not None:
+            yield
+            return
+        async with self.Session() as session:
+            token = _current_session.set(session)
+            try:
+                yield
+                await session.commit()
+            finally:
+                _current_session.reset(token)
+        self._run_after_commit(session)
+
+    @asynccontextmanager
+    async def _session(self):
+        """
+        The unit of work's session if one is active, otherwise a fresh one committed on exit.
+        """
+        session = _current_session.get()
+        if session is not None:
+            yield session
+            return
+        async with self.Session() as session:
+            yield session
+            await session.commit()
+        self._run_after_commit(session)
 
-    async def get_guild(self, guild_id):
-        guild_id = str(guild_id)
+    def _after_commit(self, session, callback, *args):
+        """Defers an in-process side effect until the session's transaction is committed"""
+        session.info.setdefault('after_commit', []).append((callback, args))
+
+    def _run_after_commit(self, session):
+        for callback, args in session.info.pop('after_commit', []):
+            callback(*args)
+
+    def _cache_guild_state(self, guild):
+        self._guild_states[guild.guild_id] = GuildState(
+            guild_id=guild.guild_id,
+            raffle_message_id=guild.raffle_message_id,
+            raffle_rolled=bool(guild.raffle_rolled),
+        )
+
+    async def load_guild_states(self):
+        """Warm the guild state cache with every guild in the database"""
         async with self.Session() as session:
+            result = await session.execute(select(Guild))
+            for guild in result.scalars().all():
+                self._cache_guild_state(guild)
+
+    async def get_guild_state(self, guild_id):
+        """
+        Returns the cached GuildState for the guild, or None if the guild is not in the database.
+
+        Only hits the database the first time an unknown guild is seen.
+        """
+        guild_id = int(guild_id)
+        if guild_id not in self._guild_states:
+            guild = await self.get_guild(guild_id)
+            if guild is None:
+                self._guild_states[guild_id] = None
+            else:
+                self._cache_guild_state(guild)
+        return self._guild_states[guild_id]
+
+    def _dialect_insert(self, table):
+        """INSERT supporting ON CONFLICT clauses for the dialect in use"""
+        if self.Engine.dialect.name == 'sqlite':
+            return sqlite.insert(table)
+        # postgres and cockroach
+        return postgresql.insert(table)
+
+    def _insert_ignore(self, table):
+        """INSERT ... ON CONFLICT DO NOTHING for the dialect in use"""
+        return self._dialect_insert(table).on_conflict_do_nothing()
+
+    async def get_guild(self, guild_id):
+        guild_id = int(guild_id)
+        async with self._session() as session:
             result = await session.execute(select(Guild).filter_by(guild_id=guild_id))
             return result.scalar_one_or_none()
 
     async def add_guild(self, guild_id):
         """Add new user to database"""
-        guild_id = str(guild_id)
-        async with self.Session() as session:
+        guild_id = int(guild_id)
+        async with self._session() as session:
             stmt = insert(Guild).values(guild_id=guild_id)
             await session.execute(stmt)
-            await session.commit()
+            self._after_commit(session, self._guild_states.__setitem__, guild_id, GuildState(guild_id=guild_id))
 
     async def start_raffle(self, guild_id, message_id):
         """Add new user to database"""
-        guild_id = str(guild_id)
-        message_id = str(message_id)
-        async with self.Session() as session:
+        guild_id = int(guild_id)
+        message_id = int(message_id)
+        async with self._session() as session:
             result = await session.execute(select(Guild).filter_by(
                 guild_id=guild_id))
             guild = result.scalar_one_or_none()
@@ -99,12 +322,12 @@ class Database:
 
             guild.raffle_message_id = message_id
             guild.raffle_rolled = False
-            await session.commit()
+            self._after_commit(session, self._cache_guild_state, guild)
 
     async def guild_remove_raffle_message_id(self, guild_id):
         """Add new user to database"""
-        guild_id = str(guild_id)
-        async with self.Session() as session:
+        guild_id = int(guild_id)
+        async with self._session() as session:
             result = await session.execute(select(Guild).filter_by(
                 guild_id=guild_id))
             guild = result.scalar_one_or_none()
@@ -112,12 +335,12 @@ class Database:
                 logger.warning(f"guild with id {guild_id} not found")
 
             guild.raffle_message_id = None
-            await session.commit()
+            self._after_commit(session, self._cache_guild_state, guild)
 
     async def guild_set_raffle_rolled(self, guild_id, rolled):
         """Add new user to database"""
-        guild_id = str(guild_id)
-        async with self.Session() as session:
+        guild_id = int(guild_id)
+        async with self._session() as session:
             result = await session.execute(select(Guild).filter_by(
                 guild_id=guild_id))
             guild = result.scalar_one_or_none()
@@ -125,71 +348,66 @@ class Database:
                 logger.warning(f"guild with id {guild_id} not found")
 
             guild.raffle_rolled = rolled
-            await session.commit()
+            self._after_commit(session, self._cache_guild_state, guild)
 
     async def add_user(self, user_id, lb_username=None, note=None):
         """Add new user to database"""
-        user_id = str(user_id)
-        async with self.Session() as session:
+        user_id = int(user_id)
+        async with self._session() as session:
             stmt = insert(User).values(user_id=user_id,
                                        lb_username=lb_username, note=note)
             await session.execute(stmt)
-            await session.commit()
 
     async def add_user_to_naughty_list(self, guild_id, user_id, reason=None):
-        user_id = str(user_id)
-        guild_id = str(guild_id)
-        async with self.Session() as session:
+        user_id = int(user_id)
+        guild_id = int(guild_id)
+        async with self._session() as session:
             stmt = insert(NaughtyList).values(guild_id=guild_id, user_id=user_id, reason=reason)
             await session.execute(stmt)
-            await session.commit()
 
     async def update_naughty_user(self, guild_id, user_id, reason=None):
-        user_id = str(user_id)
-        guild_id = str(guild_id)
-        async with self.Session() as session:
+        user_id = int(user_id)
+        guild_id = int(guild_id)
+        async with self._session() as session:
             stmt = select(NaughtyList).filter_by(guild_id=guild_id).filter_by(user_id=user_id)
             result = await session.execute(stmt)
             naughty = result.scalar_one_or_none()
             naughty.reason = reason
-            await session.commit()
 
     async def add_users_to_naughty_list(self, guild_id, user_ids):
-        guild_id = str(guild_id)
-        async with self.Session() as session:
+        guild_id = int(guild_id)
+        async with self._session() as session:
             entries = [
-                NaughtyList(user_id=str(user_id), guild_id=guild_id)
+                NaughtyList(user_id=int(user_id), guild_id=guild_id)
                 for user_id in user_ids
             ]
             session.add_all(entries)
-            await session.commit()
 
     async def remove_user_from_naughty_list(self, guild_id, user_id):
-        user_id = str(user_id)
-        guild_id = str(guild_id)
-        async with self.Session() as session:
+        user_id = int(user_id)
+        guild_id = int(guild_id)
+        async with self._session() as session:
             stmt = delete(NaughtyList).filter_by(guild_id=guild_id).filter_by(user_id=user_id)
             await session.execute(stmt)
-            await session.commit()
 
     async def get_naughtly_list(self, guild_id):
-        guild_id = str(guild_id)
-        async with self.Session() as session:
+        guild_id = int(guild_id)
+        async with self._session() as session:
             result = await session.execute(select(NaughtyList).filter_by(guild_id=guild_id))
             return result.scalars().all()
 
     async def get_user_naughty(self, guild_id, user_id):
-        user_id = str(user_id)
-        guild_id = str(guild_id)
-        async with self.Session() as session:
+        user_id = int(user_id)
+        guild_id = int(guild_id)
+        async with self._session() as session:
             stmt = select(NaughtyList).filter_by(guild_id=guild_id).filter_by(user_id=user_id)
             result = await session.execute(stmt)
             return result.scalar_one_or_none()
 
     async def update_user(self, user_id, *, lb_username=None, note=None):
         """Add new user to database"""
-        user_id = str(user_id)
-        async with self.Session() as session:
+        user_id = int(user_id)
+        async with self._session() as session:
             result = await session.execute(select(User).filter_by(
                 user_id=user_id))
             user = result.scalar_one_or_none()
@@ -198,34 +416,63 @@ class Database:
                 user.lb_username = lb_username
             if note != None:
                 user.note = note
-            await session.commit()
 
     async def get_user(self, user_id):
-        user_id = str(user_id)
-        async with self.Session() as session:
+        user_id = int(user_id)
+        async with self._session() as session:
             result = await session.execute(select(User).filter_by(user_id=user_id))
             return result.scalar_one_or_none()
 
-    async def add_raffle_entries(self, entries):
-        async with self.Session() as session:
-            session.add_all(entries)
-            await session.commit()
-
-    async def add_raffle_entry(self, guild_id, sender_id, receiver_id):
-        """Add new raffle entry to database"""
-        sender_id = str(sender_id)
-        receiver_id = str(receiver_id)
-        guild_id = str(guild_id)
-        async with self.Session() as session:
-            await session.execute(insert(Raffle).values(
-                guild_id=guild_id, sender_id=sender_id, receiver_id=receiver_id))
-            await session.commit()
+    async def get_users(self, user_ids):
+        """Returns a dict of user_id -> User for the given ids, fetched with chunked IN queries"""
+        user_ids = list({int(user_id) for user_id in user_ids})
+        users = {}
+        async with self._session() as session:
+            for i in range(0, len(user_ids), IN_CHUNK_SIZE):
+                chunk = user_ids[i:i+IN_CHUNK_SIZE]
+                result = await session.execute(select(User).where(User.user_id.in_(chunk)))
+                for user in result.scalars().all():
+                    users[user.user_id] = user
+        return users
+
+    async def admit_user(self, guild_id, user_id):
+        """
+        Creates the user if they don't exist and returns (user, naughty) for the guild.
+
+        Runs as a single transaction: one upsert and one joined select.
+        """
+        user_id = int(user_id)
+        guild_id = int(guild_id)
+        async with self._session() as session:
+            await session.execute(self._insert_ignore(User).values(user_id=user_id))
+            result = await session.execute(
+                select(User, NaughtyList)
+                .outerjoin(NaughtyList, and_(NaughtyList.user_id == User.user_id, NaughtyList.guild_id == guild_id))
+                .filter(User.user_id == user_id))
+            user, naughty = result.one()
+            return user, naughty
+
+    async def add_raffle_entries(self, guild_id, pairs):
+        """
+        Bulk insert (sender_id, receiver_id) pairs for the guild, in ring order.
+
+        Bypasses the ORM unit of work: rows go through Core executemany in chunks,
+        all in one transaction.
+        """
+        guild_id = int(guild_id)
+        rows = [
+            dict(guild_id=guild_id, sender_id=int(sender_id), receiver_id=int(receiver_id), position=position)
+            for position, (sender_id, receiver_id) in enumerate(pairs)
+        ]
+        async with self._session() as session:
+            for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+                await session.execute(insert(Raffle), rows[i:i+INSERT_CHUNK_SIZE])
 
     # Update raffle entry with movie recommendation
     async def recomm_movie(self, guild_id, sender_id, recomm, recomm_identifier):
-        sender_id = str(sender_id)
-        guild_id = str(guild_id)
-        async with self.Session() as session:
+        sender_id = int(sender_id)
+        guild_id = int(guild_id)
+        async with self._session() as session:
             result = await session.execute(select(Raffle).filter_by(guild_id=guild_id).filter_by(
                 sender_id=sender_id))
             result = result.scalar_one_or_none()
@@ -235,52 +482,150 @@ class Database:
             result.recomm = recomm
             result.recomm_identifier = recomm_identifier
 
-            await session.commit()
 
     # Get recommendation made BY a user
     async def get_all_reccs(self, guild_id):
-        guild_id = str(guild_id)
-        async with self.Session() as session:
-            result = await session.execute(select(Raffle).filter_by(guild_id=guild_id))
-            return result.scalars().all()
-
-    async def get_mia(self, guild_id):
-        guild_id = str(guild_id)
-        async with self.Session() as session:
-            result = await session.execute(select(Raffle).filter_by(guild_id=guild_id).filter_by(recomm=None))
+        guild_id = int(guild_id)
+        async with self._session() as session:
+            result = await session.execute(select(Raffle).filter_by(guild_id=guild_id).order_by(Raffle.position))
             return result.scalars().all()
 
     # Get recommendation made BY a user
     async def get_raffle_entry_by_sender(self, guild_id, sender_id):
-        guild_id = str(guild_id)
-        sender_id = str(sender_id)
-        async with self.Session() as session:
+        guild_id = int(guild_id)
+        sender_id = int(sender_id)
+        async with self._session() as session:
             result = await session.execute(select(Raffle).filter_by(guild_id=guild_id).filter_by(
                 sender_id=sender_id))
             return result.scalar_one_or_none()
 
     # Get recommendation made TO a user
     async def get_raffle_entry_by_receiver(self, guild_id, receiver_id):
-        guild_id = str(guild_id)
-        receiver_id = str(receiver_id)
-        async with self.Session() as session:
+        guild_id = int(guild_id)
+        receiver_id = int(receiver_id)
+        async with self._session() as session:
             result = await session.execute(select(Raffle).filter_by(guild_id=guild_id).filter_by(
                 receiver_id=receiver_id))
             return result.scalar_one_or_none()
 
     async def remove_all_raffle_entries_by_users(self, guild_id, user_ids):
-        guild_id = str(guild_id)
-        user_ids = [str(user_id) for user_id in user_ids]
-        async with self.Session() as session:
+        guild_id = int(guild_id)
+        user_ids = [int(user_id) for user_id in user_ids]
+        async with self._session() as session:
             stmts = delete(Raffle).filter_by(guild_id=guild_id).where(or_(Raffle.sender_id.in_(
                 user_ids), Raffle.receiver_id.in_(user_ids)))
             await session.execute(stmts)
-            await session.commit()
+
+    async def apply_reroll(self, guild_id, removed_ids, new_pairs):
+        """
+        Removes every entry involving `removed_ids` and inserts the (sender_id, receiver_id,
+        position) `new_pairs` which close the ring again, atomically.
+        """
+        guild_id = int(guild_id)
+        removed_ids = [int(user_id) for user_id in removed_ids]
+        rows = [
+            dict(guild_id=guild_id, sender_id=int(sender_id), receiver_id=int(receiver_id), position=position)
+            for sender_id, receiver_id, position in new_pairs
+        ]
+        async with self._session() as session:
+            if removed_ids:
+                await session.execute(delete(Raffle).filter_by(guild_id=guild_id).where(or_(
+                    Raffle.sender_id.in_(removed_ids), Raffle.receiver_id.in_(removed_ids))))
+            if rows:
+                await session.execute(insert(Raffle), rows)
 
     # Delete all recommendations
     async def clear_raffle_db(self, guild_id):
-        guild_id = str(guild_id)
-        async with self.Session() as session:
+        guild_id = int(guild_id)
+        async with self._session() as session:
             await session.execute(delete(Raffle).filter_by(guild_id=guild_id))
 
-            await session.commit()
+
+    async def get_film_title(self, query):
+        async with self._session() as session:
+            result = await session.execute(select(FilmTitle).filter_by(query=query))
+            return result.scalar_one_or_none()
+
+    async def set_film_title(self, query, title, url, fetched_at):
+        async with self._session() as session:
+            stmt = self._dialect_insert(FilmTitle).values(
+                query=query, title=title, url=url, fetched_at=fetched_at)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[FilmTitle.query],
+                set_=dict(title=title, url=url, fetched_at=fetched_at))
+            await session.execute(stmt)
+
+    async def record_round(self, guild_id, pairs, keep_rounds):
+        """
+        Stores the (sender_id, receiver_id) pairs of a new round and forgets rounds older
+        than the last `keep_rounds`.
+        """
+        guild_id = int(guild_id)
+        async with self._session() as session:
+            result = await session.execute(select(func.max(RaffleHistory.round)).filter_by(guild_id=guild_id))
+            round_ = (result.scalar() or 0) + 1
+            rows = [
+                dict(guild_id=guild_id, round=round_, sender_id=int(sender_id), receiver_id=int(receiver_id))
+                for sender_id, receiver_id in pairs
+            ]
+            for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+                await session.execute(insert(RaffleHistory), rows[i:i+INSERT_CHUNK_SIZE])
+            await session.execute(delete(RaffleHistory).filter_by(guild_id=guild_id).where(
+                RaffleHistory.round <= round_ - keep_rounds))
+
+    async def get_recent_pairings(self, guild_id):
+        """(sender_id, receiver_id) pairs of every round kept in the history"""
+        guild_id = int(guild_id)
+        async with self._session() as session:
+            result = await session.execute(
+                select(RaffleHistory.sender_id, RaffleHistory.receiver_id).filter_by(guild_id=guild_id))
+            return {(row.sender_id, row.receiver_id) for row in result}
+
+    async def add_pair_exclusion(self, guild_id, user_id, excluded_id):
+        async with self._session() as session:
+            await session.execute(self._insert_ignore(PairExclusion).values(
+                guild_id=int(guild_id), user_id=int(user_id), excluded_id=int(excluded_id)))
+
+    async def remove_pair_exclusion(self, guild_id, user_id, excluded_id):
+        async with self._session() as session:
+            await session.execute(delete(PairExclusion).filter_by(
+                guild_id=int(guild_id), user_id=int(user_id), excluded_id=int(excluded_id)))
+
+    async def get_pair_exclusions(self, guild_id):
+        guild_id = int(guild_id)
+        async with self._session() as session:
+            result = await session.execute(
+                select(PairExclusion.user_id, PairExclusion.excluded_id).filter_by(guild_id=guild_id))
+            return [(row.user_id, row.excluded_id) for row in result]
+
+    async def add_role_tasks(self, guild_id, role_id, action, user_ids):
+        """Queue a role change for each user, replacing any pending change of the same role"""
+        guild_id = int(guild_id)
+        role_id = int(role_id)
+        rows = [
+            dict(guild_id=guild_id, user_id=int(user_id), role_id=role_id, action=action)
+            for user_id in user_ids
+        ]
+        async with self._session() as session:
+            for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+                stmt = self._dialect_insert(RoleTask)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[RoleTask.guild_id, RoleTask.user_id, RoleTask.role_id],
+                    set_=dict(action=stmt.excluded.action))
+                await session.execute(stmt, rows[i:i+INSERT_CHUNK_SIZE])
+
+    async def get_role_tasks(self, guild_id):
+        guild_id = int(guild_id)
+        async with self._session() as session:
+            result = await session.execute(select(RoleTask).filter_by(guild_id=guild_id))
+            return result.scalars().all()
+
+    async def remove_role_tasks(self, guild_id, role_id, action, user_ids):
+        """Drops finished tasks. Tasks since replaced by the other action are left alone."""
+        guild_id = int(guild_id)
+        role_id = int(role_id)
+        user_ids = [int(user_id) for user_id in user_ids]
+        async with self._session() as session:
+            for i in range(0, len(user_ids), IN_CHUNK_SIZE):
+                await session.execute(delete(RoleTask).filter_by(guild_id=guild_id, role_id=role_id, action=action).where(
+                    RoleTask.user_id.in_(user_ids[i:i+IN_CHUNK_SIZE])))
@@ -5,19 +5,31 @@ from discord.ext import commands
 from config import CONFIG
 
 
+PRIVILEGED_ROLE_IDS = frozenset(CONFIG["GUILD"]["privileged-roles"])
+
+# guild_id -> ids of the privileged roles which exist in that guild
+_privileged_roles = {}
+
+
+def privileged_roles(guild):
+    roles = _privileged_roles.get(guild.id)
+    if roles is None:
+        roles = frozenset(role_id for role_id in PRIVILEGED_ROLE_IDS if guild.get_role(role_id))
+        _privileged_roles[guild.id] = roles
+    return roles
+
+
+def invalidate_privileged_roles(guild_id):
+    """Call when a guild's roles change"""
+    _privileged_roles.pop(guild_id, None)
+
+
 def privileged():
     async def predicate(ctx):
         if ctx.guild == None:
             return False
-
-        found_user_in_priv = False
-        for role in CONFIG["GUILD"]["privileged-roles"]:
-            priv_role = ctx.guild.get_role(role)
-            if priv_role:
-                if ctx.author in priv_role.members:
-                    found_user_in_priv = True
-                    break
-        return found_user_in_priv
+        # Member._roles holds the member's role ids, so this doesn't scan every role holder
+        return not privileged_roles(ctx.guild).isdisjoint(ctx.author._roles)
     return commands.check(predicate)
 
 
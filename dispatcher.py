@@ -0,0 +1,98 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+
+from retry import with_retries, discord_retryable
+
+logger = logging.getLogger('raffle_bot.dispatcher')
+
+# lower goes first
+PRIORITY_ASSIGNMENT = 0
+PRIORITY_INTRO = 1
+
+
+class DMDispatcher:
+    """
+    Sends DMs through a bounded pool of workers.
+
+    Messages are pulled off a priority queue, so assignment DMs are sent before intro DMs.
+    discord.py already sleeps through 429s, the dispatcher keeps the number of sends in
+    flight bounded so a large roll doesn't pile up behind the rate limiter, and retries
+    server errors.
+    """
+
+    def __init__(self, workers=5, retries=3, backoff=1.0):
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+
+        self._queue = None
+        self._tasks = []
+        self._counter = itertools.count()
+        self._in_flight = 0
+        # monotonic timestamps of recent successful sends, for throughput
+        self._sent_times = deque(maxlen=5000)
+
+        self.sent = 0
+        self.failed = 0
+        self.failed_user_ids = deque(maxlen=100)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def send(self, user, content, priority=PRIORITY_ASSIGNMENT):
+        """
+        Queues a DM. Returns a future which resolves to True if it was delivered, False otherwise.
+        """
+        self.start()
+        future = asyncio.get_event_loop().create_future()
+        self._queue.put_nowait((priority, next(self._counter), user, content, future))
+        return future
+
+    async def _worker(self):
+        while True:
+            priority, _, user, content, future = await self._queue.get()
+            self._in_flight += 1
+            try:
+                await self._deliver(user, content)
+                self.sent += 1
+                self._sent_times.append(time.monotonic())
+                delivered = True
+            except Exception as e:
+                # keep the worker alive whatever happens to a single message
+                logger.error(f'could not DM user={user.id}: {e}')
+                self.failed += 1
+                self.failed_user_ids.append(user.id)
+                delivered = False
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
+            if not future.done():
+                future.set_result(delivered)
+
+    async def _deliver(self, user, content):
+        # discord.Forbidden (DMs closed) is a 403, so it is never retried
+        await with_retries(lambda: user.send(content), discord_retryable, self.retries, self.backoff)
+
+    def stats(self):
+        now = time.monotonic()
+        last_minute = sum(1 for sent_at in self._sent_times if now - sent_at <= 60)
+        return {
+            'backlog': self._queue.qsize() if self._queue else 0,
+            'in_flight': self._in_flight,
+            'sent': self.sent,
+            'failed': self.failed,
+            'sent_last_minute': last_minute,
+        }
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+        self._tasks = []
@@ -0,0 +1,123 @@
+import csv
+import gzip
+import tempfile
+import zipfile
+from io import StringIO
+
+import discord
+
+# discord's attachment limit for regular servers
+ATTACHMENT_LIMIT = 8 * 1024 * 1024
+# compressors buffer internally, so leave room for what hasn't hit the file yet.
+# At most a quarter of the part size, so small part sizes still hold more than a write.
+PART_MARGIN = 256 * 1024
+
+
+class _Part:
+    def __init__(self, inner_name, compression):
+        self.raw = tempfile.TemporaryFile()
+        self._zip = None
+        if compression == 'gzip':
+            self.stream = gzip.GzipFile(filename=inner_name, mode='wb', fileobj=self.raw)
+        elif compression == 'zip':
+            self._zip = zipfile.ZipFile(self.raw, 'w', compression=zipfile.ZIP_DEFLATED)
+            self.stream = self._zip.open(inner_name, 'w')
+        else:
+            self.stream = self.raw
+
+    def size(self):
+        return self.raw.tell()
+
+    def finish(self):
+        if self.stream is not self.raw:
+            self.stream.close()
+        if self._zip is not None:
+            self._zip.close()
+        self.raw.seek(0)
+
+
+class ExportFile:
+    """
+    Text export that is written to a temporary file as it is produced.
+
+    Output can be gzipped or zipped and is split into several parts so none goes over the
+    attachment limit. Writes are never split across parts.
+    """
+
+    def __init__(self, filename, compression=None, part_size=ATTACHMENT_LIMIT):
+        self.filename = filename
+        self.compression = compression
+        self.part_size = part_size - min(PART_MARGIN, part_size // 4)
+        self.parts = []
+
+    def _on_new_part(self):
+        pass
+
+    def _current(self):
+        if not self.parts or self.parts[-1].size() >= self.part_size:
+            self.parts.append(_Part(self.filename, self.compression))
+            self._on_new_part()
+        return self.parts[-1]
+
+    def write(self, text):
+        self._current().stream.write(text.encode('utf-8'))
+
+    def _part_filename(self, index):
+        name = self.filename
+        if len(self.parts) > 1:
+            stem, dot, ext = name.rpartition('.')
+            name = f'{stem}.part{index + 1}.{ext}' if dot else f'{name}.part{index + 1}'
+        if self.compression == 'gzip':
+            name += '.gz'
+        elif self.compression == 'zip':
+            name += '.zip'
+        return name
+
+    def files(self):
+        """Finishes the export and returns one discord.File per part"""
+        if not self.parts:
+            self._current()
+        files = []
+        for i, part in enumerate(self.parts):
+            part.finish()
+            files.append(discord.File(part.raw, self._part_filename(i)))
+        return files
+
+    def close(self):
+        for part in self.parts:
+            part.raw.close()
+
+
+class CSVExport(ExportFile):
+    """ExportFile of csv rows, the header is repeated at the top of every part"""
+
+    def __init__(self, filename, fieldnames, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._buf = StringIO()
+        self._writer = csv.DictWriter(self._buf, fieldnames=fieldnames)
+        self._writer.writeheader()
+        self._header = self._take().encode('utf-8')
+
+    def _take(self):
+        text = self._buf.getvalue()
+        self._buf.seek(0)
+        self._buf.truncate()
+        return text
+
+    def _on_new_part(self):
+        self.parts[-1].stream.write(self._header)
+
+    def writerow(self, row):
+        self._writer.writerow(row)
+        self.write(self._take())
+
+
+async def send_exports(channel, exports):
+    """Sends every part of every export as its own message, then cleans up the temp files"""
+    try:
+        for export in exports:
+            for file in export.files():
+                await channel.send("", file=file)
+    finally:
+        for export in exports:
+            export.close()
@@ -0,0 +1,135 @@
+"""
+Backends for pulling the first film out of a Letterboxd search results page.
+
+Every extractor takes the page html and returns (title, href) of the first
+`ul.results > li` `span.film-title-wrapper > a`, or None if there are no results.
+"""
+from html.parser import HTMLParser
+import logging
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+logger = logging.getLogger('raffle_bot.extractors')
+
+# elements which never get an end tag
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr',
+])
+
+
+def extract_bs4(html):
+    """The original implementation: builds the whole tree with html.parser"""
+    soup = BeautifulSoup(html, features="html.parser")
+    anchor = soup.select_one('ul.results > li')
+    if anchor is None:
+        return None
+    film = anchor.select_one('span.film-title-wrapper > a')
+    if film is None:
+        return None
+    return film.text, film.attrs.get('href', '')
+
+
+class _Done(Exception):
+    pass
+
+
+class _FirstResultParser(HTMLParser):
+    """
+    Tracks the open element stack and bails out as soon as the first result has been read.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stack = []
+        # stack depth of the first result's <li> and of the title <a>
+        self.li_depth = None
+        self.a_depth = None
+        self.href = None
+        self.text = []
+
+    def _start(self, tag, attrs, push):
+        parent = self.stack[-1] if self.stack else None
+        if parent is not None:
+            if self.li_depth is None:
+                if tag == 'li' and parent[0] == 'ul' and 'results' in parent[1]:
+                    self.li_depth = len(self.stack)
+            elif self.a_depth is None:
+                if tag == 'a' and parent[0] == 'span' and 'film-title-wrapper' in parent[1]:
+                    self.a_depth = len(self.stack)
+                    self.href = dict(attrs).get('href') or ''
+        if push:
+            classes = (dict(attrs).get('class') or '').split()
+            self.stack.append((tag, classes))
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, tag not in VOID_ELEMENTS)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, False)
+
+    def handle_endtag(self, tag):
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                del self.stack[i:]
+                break
+        else:
+            # stray end tag
+            return
+        if self.a_depth is not None and len(self.stack) <= self.a_depth:
+            raise _Done()
+        if self.li_depth is not None and len(self.stack) <= self.li_depth:
+            # first result had no title
+            raise _Done()
+
+    def handle_data(self, data):
+        if self.a_depth is not None:
+            self.text.append(data)
+
+
+def extract_stream(html):
+    """Stdlib streaming parser, stops at the end of the first result"""
+    parser = _FirstResultParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except _Done:
+        pass
+    if parser.href is None:
+        return None
+    return ''.join(parser.text), parser.href
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def extract_lxml(html):
+    """libxml2 based, needs lxml installed"""
+    doc = lxml.html.fromstring(html)
+    results = doc.xpath(f"//ul[{_has_class('results')}]/li")
+    if not results:
+        return None
+    films = results[0].xpath(f".//span[{_has_class('film-title-wrapper')}]/a")
+    if not films:
+        return None
+    return films[0].text_content(), films[0].get('href', '')
+
+
+EXTRACTORS = {
+    'bs4': extract_bs4,
+    'stream': extract_stream,
+    'lxml': extract_lxml,
+}
+
+
+def get_extractor(name):
+    if name == 'lxml' and lxml is None:
+        logger.warning('lxml is not installed, falling back to the stream extractor')
+        name = 'stream'
+    return EXTRACTORS[name]
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import aiohttp
+
+from lb_bot import get_movie_title, normalize_query
+
+logger = logging.getLogger('raffle_bot.film_cache')
+
+
+def cache_key(query):
+    """
+    Key under which a query is cached. Queries that Letterboxd would treat the same share a key.
+    """
+    return ' '.join(normalize_query(query).lower().split())
+
+
+class FilmTitleCache:
+    """
+    Two tier cache for query -> (pretty title, film url).
+
+    The first tier is an in-memory LRU, the second is the FilmTitle table so the cache
+    survives restarts. Entries older than `ttl` are refreshed from Letterboxd, but are still
+    served if Letterboxd errors out or throttles us.
+    Misses are never cached, a film might get added to Letterboxd later.
+    """
+
+    def __init__(self, db, max_size=2048, ttl=timedelta(days=7), extractor='stream'):
+        self.db = db
+        self.extractor = extractor
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (title, url, fetched_at)
+        self._entries = OrderedDict()
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _is_fresh(self, entry):
+        return datetime.utcnow() - entry[2] < self.ttl
+
+    async def resolve(self, session, query):
+        key = cache_key(query)
+        if not key:
+            return '', ''
+
+        entry = self._get(key)
+        if entry is None:
+            row = await self.db.get_film_title(key)
+            if row is not None:
+                entry = (row.title, row.url, row.fetched_at)
+                self._put(key, entry)
+        if entry is not None and self._is_fresh(entry):
+            return entry[0], entry[1]
+
+        try:
+            title, url = await get_movie_title(session, query, self.extractor)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if entry is None:
+                raise
+            logger.warning(f"letterboxd lookup failed for '{query}', serving stale entry")
+            return entry[0], entry[1]
+
+        if not title:
+            # an error status from letterboxd looks the same as no results
+            if entry is not None:
+                return entry[0], entry[1]
+            return '', ''
+
+        entry = (title, url, datetime.utcnow())
+        self._put(key, entry)
+        await self.db.set_film_title(key, *entry)
+        return title, url
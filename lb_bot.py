@@ -5,11 +5,12 @@ from re import fullmatch
 from dataclasses import dataclass
 
 import requests
-from bs4 import BeautifulSoup
 import aiohttp
 
 from urllib.parse import urljoin, quote_plus
 
+from extractors import get_extractor
+
 logger = logging.getLogger('raffle_bot.db')
 
 LB_BASE_URL = 'https://letterboxd.com'
@@ -28,7 +29,25 @@ def prettyprint_movie(movie_title):
     return movie_title
 
 
-async def get_movie_title(query):
+def create_session(connection_limit=20, dns_cache_ttl=300, keepalive_timeout=30, timeout=15):
+    """
+    Creates the long lived, pooled http session used for all Letterboxd requests.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=connection_limit,
+        ttl_dns_cache=dns_cache_ttl,
+        keepalive_timeout=keepalive_timeout,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    )
+
+
+def normalize_query(query):
+    """
+    Rewrites a film query into the form the Letterboxd search handles best.
+    """
     year = __check_year(query)
     if year:
         # XXX: if year is in brackets, the LB search returns wrong results
@@ -40,43 +59,104 @@ async def get_movie_title(query):
     # XXX: lb bot doesn't handle this case either, but once it does, we'll need to do it as well
     # query = query.replace('/', ' ')
     query = query.replace('.', ' ')
-    async with aiohttp.ClientSession(loop=asyncio.get_event_loop()) as session:
-        async with session.get(urljoin(LB_SEARCH_ENDPOINT, quote_plus(query))) as resp:
-            if resp.status >= 400:
-                return '', ''
-            soup = BeautifulSoup(await resp.text(), features="html.parser")
-            anchor = soup.select_one('ul.results > li')
-            if anchor == None:
-                return '', ''
-            film = anchor.select_one('span.film-title-wrapper > a')
-            title = film.text
-            url = film.attrs.get('href', '')
-            logger.info(f"got title '{title}' and '{url}' for query '{query}'")
-            return prettyprint_movie(title), url
-    return '', ''
+    return query
+
+
+async def get_movie_title(session, query, extractor='stream'):
+    """
+    Returns the pretty title and film url of the top search result for the query.
+
+    `extractor` names one of the backends in extractors.EXTRACTORS. Parsing runs in the
+    default executor so it doesn't block the event loop.
+    """
+    query = normalize_query(query)
+    async with session.get(urljoin(LB_SEARCH_ENDPOINT, quote_plus(query))) as resp:
+        if resp.status >= 400:
+            return '', ''
+        html = await resp.text()
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(None, get_extractor(extractor), html)
+    if result is None:
+        return '', ''
+    title, url = result
+    logger.info(f"got title '{title}' and '{url}' for query '{query}'")
+    return prettyprint_movie(title), url
+
+
+# how much of a film page we are willing to read looking for the rating
+RATING_READ_LIMIT = 256 * 1024
+RATING_CHUNK_SIZE = 16 * 1024
+# the page owner's rating is the large one in the review header, the rated-N spans elsewhere
+# on the page belong to friends and popular reviews
+RATING_RE = re.compile(rb'class="[^"]*\brating-large\b[^"]*\brated-large-(\d+)\b')
+# end of the review header: no rating by then means the review isn't rated
+REVIEW_HEADER_END_RE = re.compile(rb'class="film-header-lockup".*?</header>', re.DOTALL)
 
 
 @dataclass
 class FilmReview:
     user: str
     url: str
+    # in half stars, 1-10
     rating: int
 
 
-async def get_user_review(session, user, film_id):
+def _check_review_status(resp):
+    if resp.status == 429 or resp.status >= 500:
+        # throttled or letterboxd is having issues, let the caller retry
+        resp.raise_for_status()
+    return resp.status < 400
+
+
+async def _read_rating(resp):
+    """
+    Reads the page in chunks until the review header has been read, giving up after
+    RATING_READ_LIMIT bytes. Returns the owner's rating, None if the review isn't rated.
+    """
+    buf = b''
+    while len(buf) < RATING_READ_LIMIT:
+        chunk = await resp.content.read(RATING_CHUNK_SIZE)
+        if not chunk:
+            break
+        buf += chunk
+        match = RATING_RE.search(buf)
+        if match:
+            return int(match.group(1))
+        if REVIEW_HEADER_END_RE.search(buf):
+            return None
+    return None
+
+
+async def get_user_review(session, user, film_id, with_rating=False):
+    """
+    Returns a FilmReview if the user has logged the film, None otherwise.
+
+    Without `with_rating` this is just a HEAD request. With it, only as much of the page
+    as is needed to find the rating is downloaded. aiohttp can't put a connection with
+    an unread body back in the pool, so every rated lookup costs a new connection.
+    """
     user = user.strip()
     url = f'{LB_BASE_URL}/{user}{film_id}'
     logger.info(f'fetching url {url}')
+    if not with_rating:
+        async with session.head(url, allow_redirects=True) as resp:
+            logger.info(f'got status {resp.status}')
+            if resp.status != 405:
+                if not _check_review_status(resp):
+                    return None
+                return FilmReview(user, url, None)
     async with session.get(url) as resp:
         logger.info(f'got status {resp.status}')
-        if resp.status >= 400:
+        if not _check_review_status(resp):
             return None
-        return FilmReview(user, url, None)
-    return None
+        rating = None
+        if with_rating:
+            rating = await _read_rating(resp)
+        return FilmReview(user, url, rating)
 
 async def try_get_user_review(session, user, film_name):
     print(f'getting {film_name}')
-    title, url = await get_movie_title(film_name)
+    title, url = await get_movie_title(session, film_name)
     if url:
         return await get_user_review(session, user, url)
 
@@ -114,9 +194,11 @@ def __check_year(keywords):
 
 
 if __name__ == '__main__':
-    # t = get_movie_title('little forest summer/autumn')
-    t = get_movie_title('young mr. Lincoln')
-    #t = get_user_review('vnki', '/film/my-own-private-idaho')
+    async def _main():
+        async with create_session() as session:
+            # return await get_movie_title(session, 'little forest summer/autumn')
+            return await get_movie_title(session, 'young mr. Lincoln')
+            # return await get_user_review(session, 'vnki', '/film/my-own-private-idaho')
     loop = asyncio.get_event_loop()
-    r = loop.run_until_complete(t)
+    r = loop.run_until_complete(_main())
     print(r)
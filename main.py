@@ -1,22 +1,27 @@
 import asyncio
 import discord
 import logging
-import random
 import copy
 import re
 import os
-import csv
 import functools
 from datetime import datetime, timedelta, timezone
-from io import StringIO
 
 from discord.ext import commands
-import aiohttp
-
 from config import CONFIG
-from lb_bot import get_movie_title, get_user_review, try_get_user_review
-from db import Database, Raffle
-from decorators import only_in_debug_channel, only_in_raffle_channel, typing_indicator, privileged
+from lb_bot import create_session
+from db import Database
+from raffle import FilmRaffle, Ring, ring_pairs
+from film_cache import FilmTitleCache
+from reviews import ReviewVerifier, review_key
+from export import ExportFile, CSVExport, send_exports
+from roles import RoleScheduler, ADD, REMOVE
+from messaging import send_packed, silent_pin_message
+from reactions import ReactionCoalescer, ReactionQueue
+from mia import MIAReport, NameResolver
+from members import MemberCache, client_options
+from dispatcher import DMDispatcher, PRIORITY_ASSIGNMENT, PRIORITY_INTRO
+from decorators import only_in_debug_channel, only_in_raffle_channel, typing_indicator, privileged, invalidate_privileged_roles
 
 from commands.userdata import Userdata
 from commands.usercontrol import Usercontrol
@@ -25,6 +30,13 @@ client = discord.Client()
 
 db = Database(
     CONFIG["DATABASE_URL"],
+    pool=CONFIG["DATABASE_POOL"],
+)
+film_titles = FilmTitleCache(
+    db,
+    max_size=CONFIG["LETTERBOXD"]["title-cache-size"],
+    ttl=timedelta(seconds=CONFIG["LETTERBOXD"]["title-cache-ttl"]),
+    extractor=CONFIG["LETTERBOXD"]["html-extractor"],
 )
 logger = logging.getLogger('raffle_bot')
 
@@ -41,21 +53,83 @@ class MyClient(commands.Bot):
         # ID of the message that can be reacted to to add/remove a role.
         self.role_message_id = 0
 
+        self.dm_dispatcher = DMDispatcher(
+            workers=CONFIG["DM"]["workers"],
+            retries=CONFIG["DM"]["retries"],
+        )
+        self._lb_session = None
+        self.role_scheduler = RoleScheduler(
+            self, db,
+            concurrency=CONFIG["ROLES"]["concurrency"],
+            retries=CONFIG["ROLES"]["retries"],
+            debug_channel_id=CONFIG["GUILD"].get("debug-channel-id"),
+        )
+        self._resumed_role_tasks = False
+        self.reaction_queue = ReactionQueue(
+            self.handle_reaction,
+            workers=CONFIG["REACTIONS"]["workers"],
+            max_size=CONFIG["REACTIONS"]["max-backlog"],
+        )
+        self.reactions = ReactionCoalescer(
+            self.reaction_queue.submit, window=CONFIG["REACTIONS"]["coalesce-window"])
+        self.names = NameResolver(self, concurrency=CONFIG["MIA"]["resolve-concurrency"])
+        self.members = MemberCache(
+            self, db,
+            policy=CONFIG["MEMBERS"]["cache-policy"],
+            raffle_role_id=raffle_role_id,
+            privileged_role_ids=CONFIG["GUILD"]["privileged-roles"],
+            prune_interval=CONFIG["MEMBERS"]["prune-interval"],
+        )
+
+    @property
+    def lb_session(self):
+        """
+        Shared http session for Letterboxd, created on first use inside the running loop.
+        """
+        if self._lb_session is None or self._lb_session.closed:
+            self._lb_session = create_session(
+                connection_limit=CONFIG["LETTERBOXD"]["connection-limit"],
+                timeout=CONFIG["LETTERBOXD"]["timeout"],
+            )
+        return self._lb_session
+
+    async def close(self):
+        await self.dm_dispatcher.close()
+        await self.reaction_queue.close()
+        await self.members.close()
+        if self._lb_session is not None:
+            await self._lb_session.close()
+        await super().close()
+
     async def clear_raffle_role(self, guild):
         raffle_role = guild.get_role(self.raffle_role_id)
-        tasks = [asyncio.create_task(member.remove_roles(
-            raffle_role)) for member in raffle_role.members]
-        if tasks:
-            await asyncio.wait(tasks)
+        await self.role_scheduler.run(guild, raffle_role, REMOVE,
+                                      [member.id for member in raffle_role.members],
+                                      'clearing raffle role')
 
-    async def ping_user(self, guild, user1, user2):
+    async def on_ready(self):
+        # on_ready also fires after reconnects
+        if self._resumed_role_tasks:
+            return
+        self._resumed_role_tasks = True
+        self.members.start()
+        for guild in self.guilds:
+            await self.members.warm(guild)
+            await self.role_scheduler.resume(guild)
+
+    async def ping_user(self, guild, user1, user2, profiles):
+        """
+        DM user1 their assignment. `profiles` is a prefetched map of user_id -> db User.
+
+        Returns False if the DM could not be delivered.
+        """
         member = guild.get_member(user1.id)
         raffle_channel = guild.get_channel(CONFIG["GUILD"]["film-raffle-channel-id"])
 
         if member is None:
-            return
-        lb_user1 = await db.get_user(user1.id)
-        lb_user2 = await db.get_user(user2.id)
+            return True
+        lb_user1 = profiles.get(user1.id)
+        lb_user2 = profiles.get(user2.id)
         message = f"""
 __**Film Raffle Assignment**__
 The time has come! Please provide your recommendation in the r/Letterboxd server within 24 hours of this message.
@@ -78,98 +152,46 @@ The time has come! Please provide your recommendation in the r/Letterboxd server
 
         message += f'\nTo submit your recommendation, head to the r/Letterboxd server {raffle_channel.mention} channel and use the `!f` command. Remember to tag your partner and let them know why you chose the film!'
 
-        await user1.send(message)
+        return await self.dm_dispatcher.send(user1, message, PRIORITY_ASSIGNMENT)
 
-    def create_random_mapping(self, users):
+    async def create_random_mapping(self, guild, users):
         """
         Creates a random mapping between users
 
-        This creates a ring of users. The algo does this by shuffling the user list
-        and adding an edge from ith user to i+1 th user if i!=n. For the last user, an edge
-        is added to the first user.
+        This creates a ring of users, avoiding the pairings of the last few rounds and the
+        guild's pair exclusions where possible. See raffle.FilmRaffle.
         """
-        # users would be Discord usernames
-        random.shuffle(users)
-        randomized_list = []
-        for i in range(len(users)-1):
-            randomized_list.append((users[i], users[i+1]))
-        randomized_list.append((users[-1], users[0]))
-        return randomized_list
-
-    def raffle_entries_to_list(self, raffle_entries):
-        entry_map = {}
-        for entry in raffle_entries:
-            entry_map[entry.sender_id] = entry.receiver_id
-        first = raffle_entries[0].sender_id
-        lst = [first]
-        curr = entry_map[first]
-        while curr != first:
-            lst.append(curr)
-            curr = entry_map[curr]
-        return lst
-
-    def raffle_entries_to_orig_entry_list(self, raffle_entries):
-        # TODO: this is duplication of above code. fix this.
-        lookup = {}
-        entry_map = {}
-        for entry in raffle_entries:
-            lookup[entry.sender_id] = entry
-            entry_map[entry.sender_id] = entry.receiver_id
-        first = raffle_entries[0].sender_id
-        lst = [lookup[first]]
-        curr = entry_map[first]
-        while curr != first:
-            lst.append(lookup[curr])
-            curr = entry_map[curr]
-        return lst
+        forbidden = await db.get_recent_pairings(guild.id)
+        for user_id, excluded_id in await db.get_pair_exclusions(guild.id):
+            forbidden.update([(user_id, excluded_id), (excluded_id, user_id)])
+        members = {user.id: user for user in users}
+        ring, violations = FilmRaffle(forbidden).build_ring(members)
+        if violations:
+            logger.warning(f'roll for guild={guild.id} repeats {violations} forbidden pairings')
+        return [(members[sender], members[receiver]) for sender, receiver in ring_pairs(ring)]
 
     async def is_user_allowed(self, guild_id, discord_user):
-        dbuser = await db.get_user(discord_user.id)
-        if dbuser is None or dbuser.lb_username is None:
-            await discord_user.send(CONFIG["CHAT"]["DM_INTRO"])
+        """
+        Registers the user if needed and checks whether they can join the raffle.
+        """
+        dbuser, naughty = await db.admit_user(guild_id, discord_user.id)
+        if dbuser.lb_username is None:
+            self.dm_dispatcher.send(discord_user, CONFIG["CHAT"]["DM_INTRO"], PRIORITY_INTRO)
             return False
-        naughty = await db.get_user_naughty(guild_id, discord_user.id)
         if naughty:
             logger.info("user {discord_user.id} naughty")
             message = "You've been banned from participating in the raffle. Contact the mods if you think this is a mistake."
             if naughty.reason:
                 message += f'\nReason: {naughty.reason}'
-            await discord_user.send(message)
+            self.dm_dispatcher.send(discord_user, message, PRIORITY_INTRO)
             return False
         return True
 
-    async def create_user_if_not_exist(self, user):
-        dbuser = await db.get_user(user.id)
-        if dbuser is None:
-            await db.add_user(user.id)
-
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         """Gives a role based on a reaction emoji."""
         if not await self.check_emoji_payload(payload):
             return
-
-        guild = self.get_guild(payload.guild_id)
-
-        role = guild.get_role(self.raffle_role_id)
-        if role is None:
-            logger.error("could not find role to add")
-            return
-
-        await self.create_user_if_not_exist(payload.member)
-        user_allowed = await self.is_user_allowed(payload.guild_id, payload.member)
-        if user_allowed:
-            try:
-                await payload.member.add_roles(role)
-                logger.info(f'role assigned to {payload.member.name}')
-            except discord.HTTPException:
-                logger.error("error while adding role")
-                raise
-        else:
-            channel = self.get_channel(payload.channel_id)
-            message = await channel.fetch_message(payload.message_id)
-            user = self.get_user(payload.user_id)
-            await message.remove_reaction(payload.emoji, user)
-
+        self.reactions.push(payload, True)
 
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
         """
@@ -177,37 +199,65 @@ The time has come! Please provide your recommendation in the r/Letterboxd server
         """
         if not await self.check_emoji_payload(payload):
             return
+        self.reactions.push(payload, False)
 
+    async def handle_reaction(self, payload: discord.RawReactionActionEvent, added):
+        """
+        Applies the net result of a user's reaction events, see reactions.ReactionCoalescer.
+        """
         guild = self.get_guild(payload.guild_id)
         role = guild.get_role(self.raffle_role_id)
         if role is None:
             logger.error("role is not defined")
             return
 
-        member = guild.get_member(payload.user_id)
+        member = payload.member if added else await self.members.get(guild, payload.user_id)
         if member is None:
             logger.warning(f"member of id '{payload.user_id}' not found")
-            return False
+            return
+
+        # already in the state the user ended up asking for
+        if (role in member.roles) == added:
+            return
+
+        if not added:
+            if await self.role_scheduler.apply(member, role, REMOVE):
+                logger.info(f'role removed from {member.name}')
+            return
+
+        user_allowed = await self.is_user_allowed(payload.guild_id, member)
+        if user_allowed:
+            if await self.role_scheduler.apply(member, role, ADD):
+                logger.info(f'role assigned to {member.name}')
+        else:
+            channel = self.get_channel(payload.channel_id)
+            message = await channel.fetch_message(payload.message_id)
+            user = self.get_user(payload.user_id)
+            await message.remove_reaction(payload.emoji, user)
 
-        try:
-            await member.remove_roles(role)
-            logger.info(f'role removed from {member.name}')
-        except discord.HTTPException:
-            pass
+    async def on_guild_role_create(self, role):
+        invalidate_privileged_roles(role.guild.id)
+
+    async def on_guild_role_delete(self, role):
+        invalidate_privileged_roles(role.guild.id)
+
+    async def on_guild_role_update(self, before, after):
+        invalidate_privileged_roles(after.guild.id)
 
     async def check_emoji_payload(self, payload: discord.RawReactionActionEvent) -> bool:
         """
         Check if emoji is the one we care about and all it's properties are correct.
         """
-        db_guild = await db.get_guild(payload.guild_id)
-        logger.info(f'got emoji payload: db_guild={db_guild}')
-        if db_guild.raffle_message_id is None:
-            logger.info(f'guild={payload.guild_id} no raffle message_id')
-            return
+        if payload.guild_id is None:
+            return False
+        # served from the in-process cache, so reactions elsewhere never touch the db
+        guild_state = await db.get_guild_state(payload.guild_id)
+        if guild_state is None or guild_state.raffle_message_id is None:
+            return False
         # only care about the message
-        if payload.message_id != int(db_guild.raffle_message_id):
-            logger.info(f'payload message id={payload.message_id} does not match raffle_message_id={db_guild.raffle_message_id}')
+        if payload.message_id != guild_state.raffle_message_id:
             return False
+        logger.info(f'got emoji payload: guild_state={guild_state}')
         # dont add role to the bot
         if payload.member == self.user:
             return False
@@ -230,14 +280,8 @@ intents.members = True
 raffle_channel_id = CONFIG["GUILD"]["film-raffle-channel-id"]
 raffle_role_id = CONFIG["GUILD"]["film-raffle-role-id"]
 
-bot = MyClient(raffle_channel_id, raffle_role_id, command_prefix='!', intents=intents)
-
-
-async def silent_pin_message(message: discord.Message):
-    try:
-        await message.pin()
-    except discord.Forbidden:
-        logger.warn("don't have perms for pinning message")
+bot = MyClient(raffle_channel_id, raffle_role_id, command_prefix='!', intents=intents,
+               **client_options(CONFIG["MEMBERS"]["cache-policy"]))
 
 
 # TODO: use discord.py Cogs for these commands
@@ -293,13 +337,12 @@ async def raffle_resume(ctx):
     await ctx.channel.send("Film raffle stopped.")
 
 async def add_guild_if_not_exists(guild_id):
-    guild = await db.get_guild(guild_id)
+    guild = await db.get_guild_state(guild_id)
     if guild is None:
         await db.add_guild(guild_id)
 
 async def send_roll_msg(map_list, channel):
-    pin_tasks = []
-    roll_msg = ''
+    lines = []
     for pair in map_list:
         if pair[0] is None or pair[1] is None:
             # XXX: this is a hack :'
@@ -310,19 +353,10 @@ async def send_roll_msg(map_list, channel):
             if pair[1]:
                 user = pair[1].mention
             # one of the user couldnt be found, because they probably left he server
-            roll_msg += '{user} could not be matched because "reasons". Contact the bot admin and threaten him to write better code.'
+            lines.append(f'{user} could not be matched because "reasons". Contact the bot admin and threaten him to write better code.')
             continue
-        roll_msg += '{} » {}\n'.format(pair[0].mention, pair[1].mention)
-        # This length is due to Discord forbidding messages greater than 2k chars
-        if len(roll_msg) > 1950:
-            message = await channel.send(roll_msg)
-            pin_tasks.append(asyncio.create_task(silent_pin_message(message)))
-            roll_msg = ''
-
-    if len(roll_msg) > 0:
-        message = await channel.send(roll_msg)
-        pin_tasks.append(asyncio.create_task(silent_pin_message(message)))
-    await asyncio.wait(pin_tasks)
+        lines.append('{} » {}'.format(pair[0].mention, pair[1].mention))
+    await send_packed(channel, lines, pin=True)
 
 
 async def unpin_all_bot_messages(ctx):
@@ -349,27 +383,36 @@ async def roll_raffle(ctx):
         await ctx.channel.send("Not enough users for rolling the raffle.")
         return
 
-    await db.clear_raffle_db(guild.id)
     emoji = bot.get_emoji(774310027359158273)
     if not emoji:
         emoji = ''
     await ctx.channel.send(f"The Senate knows what's best for you. {emoji}")
-    rando_list = bot.create_random_mapping(users)
+    rando_list = await bot.create_random_mapping(guild, users)
+    # keep this round's participants cached even once they lose the raffle role
+    await bot.members.ensure(guild, [user.id for user in users])
     await send_roll_msg(rando_list, ctx.channel)
 
-    await db.add_raffle_entries([
-        Raffle(guild_id=str(guild.id), sender_id=str(pair[0].id), receiver_id=str(pair[1].id), recomm=None)
-        for pair in rando_list
-    ])
+    # one connection and transaction for the whole roll
+    async with db.unit_of_work():
+        pairs = [(pair[0].id, pair[1].id) for pair in rando_list]
+        await db.clear_raffle_db(guild.id)
+        await db.add_raffle_entries(guild.id, pairs)
+        await db.record_round(guild.id, pairs, CONFIG["GUILD"]["pairing-history-rounds"])
+        await db.guild_set_raffle_rolled(guild.id, True)
+        await db.guild_remove_raffle_message_id(guild.id)
+        profiles = await db.get_users(user.id for user in users)
     # TODO: Put chat in cfg
     await ctx.channel.send("That's all folks! If there's an issue contact the mods, otherwise have fun!")
 
-    await db.guild_set_raffle_rolled(guild.id, True)
-    await db.guild_remove_raffle_message_id(guild.id)
-
-    ping_tasks = [bot.ping_user(guild, pair[0], pair[1])
-                  for pair in rando_list]
-    await asyncio.wait(ping_tasks)
+    delivered = await asyncio.gather(*[bot.ping_user(guild, pair[0], pair[1], profiles)
+                                       for pair in rando_list])
+    undelivered = [pair[0] for pair, ok in zip(rando_list, delivered) if not ok]
+    if undelivered:
+        logger.error(f'could not DM {len(undelivered)} users after roll')
+        debug_channel = bot.get_channel(CONFIG["GUILD"].get("debug-channel-id"))
+        if debug_channel:
+            await debug_channel.send(f"Could not DM {len(undelivered)} users their assignment: " +
+                                     ' '.join(str(user.id) for user in undelivered))
 
 
 def get_entry_map(raffle_entries):
@@ -385,26 +428,24 @@ def get_entry_map(raffle_entries):
 async def debug(ctx):
     guild = ctx.guild
 
-    raffle_role = guild.get_role(raffle_role_id)
-    # mia_members = raffle_role.members
-    mia_members = await db.get_mia(guild.id)
-    mia_member_id_set = set([str(member.sender_id) for member in mia_members])
-    logger.info(f'mia_member_id_set={mia_member_id_set}')
+    report = await MIAReport.build(db, guild, bot.members)
+    logger.info(f'mia_ids={report.mia_ids}, left_ids={report.left_ids}')
 
-    raffle_entries = await db.get_all_reccs(guild.id)
-    for entry in raffle_entries:
-        if ctx.guild.get_member(int(entry.sender_id)) is None:
-            logger.info(f'user with id={entry.sender_id} left the server')
-            mia_member_id_set.add(str(entry.sender_id))
-    logger.info(f'final mia_member_id_set={mia_member_id_set}')
-
-    message = 'MIA\n'
-    for mia in mia_member_id_set:
-        try:
-            user = await bot.fetch_user(mia)
-        except discord.NotFound:
-            continue
-        message += f'{user.name}\n'
+    names = await bot.names.resolve(guild, report.mia_ids)
+    await send_packed(ctx.channel, ['MIA'] + list(names.values()))
+
+@bot.command(name='fr-stats')
+@privileged()
+@only_in_debug_channel()
+async def stats(ctx):
+    """
+    Shows outbound DM and reaction queue metrics.
+    """
+    dm_stats = bot.dm_dispatcher.stats()
+    reaction_stats = bot.reaction_queue.stats()
+    reaction_stats['coalesced'] = bot.reactions.coalesced
+    message = '**DMs**\n' + '\n'.join(f'{key}: {value}' for key, value in dm_stats.items())
+    message += '\n\n**Reactions**\n' + '\n'.join(f'{key}: {value}' for key, value in reaction_stats.items())
     await ctx.channel.send(message)
 
 @bot.command(name='fr-reroll')
@@ -414,45 +455,44 @@ async def reroll(ctx):
     """
     Removes the role from MIA person and assigns the role to their raffle partner if they are not MIA.
     """
-    if not (await db.get_guild(ctx.guild.id)).raffle_rolled:
+    guild_state = await db.get_guild_state(ctx.guild.id)
+    if guild_state is None or not guild_state.raffle_rolled:
         await ctx.channel.send("Cannot re-roll before rolling.")
         return
 
     guild = ctx.guild
     raffle_role = guild.get_role(raffle_role_id)
-    # mia_members = raffle_role.members
-    mia_members = await db.get_mia(guild.id)
-    mia_member_id_set = set([str(member.sender_id) for member in mia_members])
-
-    # await db.add_users_to_naughty_list(guild.id, mia_member_id_set)
-    raffle_entries = await db.get_all_reccs(guild.id)
-    for entry in raffle_entries:
-        if ctx.guild.get_member(int(entry.sender_id)) is None:
-            mia_member_id_set.add(str(entry.sender_id))
+    report = await MIAReport.build(db, guild, bot.members)
+    mia_member_id_set = report.mia_ids
+    raffle_entries = report.entries
 
     if len(raffle_entries) - len(mia_member_id_set) < 2:
         await ctx.channel.send("Too few people to re-roll.")
         return
 
     entry_map = get_entry_map(raffle_entries)
-    entry_list = bot.raffle_entries_to_list(raffle_entries)
-    await db.remove_all_raffle_entries_by_users(guild.id, [member for member in mia_member_id_set])
+    # entries come back in ring order
+    ring = Ring(entry.sender_id for entry in raffle_entries)
+    positions = {entry.sender_id: entry.position for entry in raffle_entries}
 
-    new_entry_list = [uid for uid in entry_list if uid not in mia_member_id_set]
+    new_entries = []
     new_pairings = []
-    i = 0
     tasks = []
 
-    for i in range(-1, len(new_entry_list)-1):
-        curr = new_entry_list[i]
-        next_ = new_entry_list[i+1]
+    for curr, next_ in ring.remove(mia_member_id_set):
         if entry_map[curr] != next_:
-            tasks.append(asyncio.create_task(db.add_raffle_entry(guild.id, curr, next_)))
-            new_pairings.append((ctx.guild.get_member(int(curr)), ctx.guild.get_member(int(next_))))
+            # the sender keeps its place in the ring, nothing else needs renumbering
+            new_entries.append((curr, next_, positions[curr]))
+            new_pairings.append((ctx.guild.get_member(curr), ctx.guild.get_member(next_)))
+
+    # delete and inserts happen in a single transaction, the ring is never left half done
+    await db.apply_reroll(guild.id, mia_member_id_set, new_entries)
 
+    profiles = await db.get_users(user.id for pair in new_pairings for user in pair if user)
+    tasks.append(asyncio.create_task(bot.role_scheduler.run(
+        guild, raffle_role, ADD, [pair[0].id for pair in new_pairings], 'reroll')))
     for pair in new_pairings:
-        tasks.append(asyncio.create_task(pair[0].add_roles(raffle_role)))
-        tasks.append(asyncio.create_task(bot.ping_user(guild, pair[0], pair[1])))
+        tasks.append(asyncio.create_task(bot.ping_user(guild, pair[0], pair[1], profiles)))
     if new_pairings:
         await send_roll_msg(new_pairings, ctx.channel)
     else:
@@ -487,122 +527,117 @@ async def dump_recs_raw(ctx, with_reviews=False):
     recs = await db.get_all_reccs(ctx.guild.id)
     if len(recs) == 0:
         return
-    roll_msg = ''
-    csv_content = StringIO()
-    csv_review_content = StringIO()
-    naughty_users = StringIO()
-    csv_writer = csv.DictWriter(csv_content, fieldnames=['Position', 'Name', 'Year', 'Description'])
-    csv_writer.writeheader()
+    # rows are streamed into temp files as they are produced, see export.py
+    export_options = dict(
+        compression=CONFIG["EXPORT"]["compression"],
+        part_size=CONFIG["EXPORT"]["part-size"],
+    )
+    roll_msg = ExportFile("recs.txt", **export_options)
+    csv_writer = CSVExport("recs.csv", ['Position', 'Name', 'Year', 'Description'], **export_options)
+    exports = [roll_msg, csv_writer]
     if with_reviews:
-        csv_naughty = csv.DictWriter(naughty_users, fieldnames=['naughty_user', 'naughty_user_id', 'recommendation', 'sender'])
-        csv_naughty.writeheader()
-        csv_review_writer = csv.DictWriter(csv_review_content, fieldnames=['sender', 'receiver', 'sender_lb', 'receiver_lb', 'sender_id', 'receiver_id', 'film_title', 'film_id', 'review_link', 'review_rating'])
-        csv_review_writer.writeheader()
-    recs = [rec for rec in bot.raffle_entries_to_orig_entry_list(recs) if rec.recomm]
-    logger.info(f'dump-recs: recs={recs}')
-    review_map = {}
-
-    if with_reviews:
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-            for rec in recs:
-                if rec.receiver.lb_username and rec.recomm_identifier:
-                    film_id = rec.recomm_identifier
-                    tasks.append(asyncio.ensure_future(get_user_review(session, rec.receiver.lb_username, film_id)))
-                elif rec.receiver.lb_username:
-                    film_id = rec.recomm
-                    tasks.append(asyncio.ensure_future(try_get_user_review(session, rec.receiver.lb_username, film_id)))
-                reviews = await asyncio.gather(*tasks)
-                for review in reviews:
-                    if review:
-                        review_map[review.user] = review
-
-    logger.info(f'review_map={review_map}')
-
-    def linkify_user(name, lb_username):
-        if lb_username is None:
-            return name
-        return f'<a href="https://letterboxd.com/{lb_username}">{name}</a>'
-    for position, rec in enumerate(recs):
-        d_sender = bot.get_user(int(rec.sender.user_id))
-        d_receiver = bot.get_user(int(rec.receiver.user_id))
-        if d_sender == None or d_receiver == None:
-            logger.error("sender or receiver not found. this shouldnt happen really.")
-            continue
+        csv_review_writer = CSVExport("backup.csv", ['sender', 'receiver', 'sender_lb', 'receiver_lb', 'sender_id', 'receiver_id', 'film_title', 'film_id', 'review_link', 'review_rating'], **export_options)
+        csv_naughty = CSVExport("naughtylist.csv", ['naughty_user', 'naughty_user_id', 'recommendation', 'sender'], **export_options)
+        exports += [csv_review_writer, csv_naughty]
+    # send_exports cleans up the temp files, this covers anything raising before it
+    try:
+        recs = [rec for rec in recs if rec.recomm]
+        logger.info(f'dump-recs: recs={recs}')
+        review_map = {}
 
-        movie_title = rec.recomm
-        review = None
-
-        sender_name = d_sender.name
-        if rec.sender.lb_username:
-            sender_name = f'<a href="https://letterboxd.com/{rec.sender.lb_username}">{sender_name}</a>'
-        receiver_name = d_receiver.name
-        if rec.receiver.lb_username:
-            review = review_map.get(rec.receiver.lb_username)
-            receiver_name = f'<a href="https://letterboxd.com/{rec.receiver.lb_username}">{receiver_name}</a>'
-
-        # TODO: refactor
-        movie_split = movie_title.rsplit('(', 1)
-        if len(movie_split) == 2:
-            movie, year = movie_split
-        else:
-            movie, year = movie_title, ''
-        movie = movie.strip()
-        year = year.strip(')')
-        if len(year) != 4:
-            movie = movie_title
-            year = ''
-        if review:
-            roll_msg += f'{sender_name} » {receiver_name} | <b>{movie}</b> ({year}) | <a href="{review.url}">Review</a>\n'
-        else:
-            roll_msg += f'{sender_name} » {receiver_name} | <b>{movie}</b> ({year})\n'
-        sender_link = linkify_user(d_sender.name, rec.sender.lb_username)
-        receiver_link = linkify_user(d_receiver.name, rec.receiver.lb_username)
-        description = f'{sender_link} » {receiver_link}'
-        if review:
-            description += f' <a href="{review.url}">Link to review</a>'
-        else:
-            if with_reviews:
-                csv_naughty.writerow({
-                    'naughty_user': d_receiver.name,
-                    'naughty_user_id': d_receiver.id,
-                    'recommendation': rec.recomm,
-                    'sender': d_sender.name,
-                })
-        csv_writer.writerow({
-            "Position": position,
-            "Name": movie,
-            "Year": year,
-            "Description": description
-        })
         if with_reviews:
-            review = review_map.get(rec.receiver.lb_username)
-            review_link = None
-            review_rating = None
+            verifier = ReviewVerifier(
+                bot.lb_session, film_titles,
+                concurrency=CONFIG["LETTERBOXD"]["review-concurrency"],
+                retries=CONFIG["LETTERBOXD"]["review-retries"],
+                with_rating=CONFIG["LETTERBOXD"]["review-ratings"],
+            )
+            async for key, review in verifier.verify(recs):
+                if review:
+                    review_map[key] = review
+
+        logger.info(f'review_map={review_map}')
+
+        def linkify_user(name, lb_username):
+            if lb_username is None:
+                return name
+            return f'<a href="https://letterboxd.com/{lb_username}">{name}</a>'
+        for position, rec in enumerate(recs):
+            d_sender = bot.get_user(rec.sender.user_id)
+            d_receiver = bot.get_user(rec.receiver.user_id)
+            if d_sender == None or d_receiver == None:
+                logger.error("sender or receiver not found. this shouldnt happen really.")
+                continue
+
+            movie_title = rec.recomm
+            review = None
+
+            sender_name = d_sender.name
+            if rec.sender.lb_username:
+                sender_name = f'<a href="https://letterboxd.com/{rec.sender.lb_username}">{sender_name}</a>'
+            receiver_name = d_receiver.name
+            if rec.receiver.lb_username:
+                review = review_map.get(review_key(rec))
+                receiver_name = f'<a href="https://letterboxd.com/{rec.receiver.lb_username}">{receiver_name}</a>'
+
+            # TODO: refactor
+            movie_split = movie_title.rsplit('(', 1)
+            if len(movie_split) == 2:
+                movie, year = movie_split
+            else:
+                movie, year = movie_title, ''
+            movie = movie.strip()
+            year = year.strip(')')
+            if len(year) != 4:
+                movie = movie_title
+                year = ''
             if review:
-                review_link = review.url
-                review_rating = review.rating
-            csv_review_writer.writerow({
-                'sender': d_sender.name,
-                'receiver': d_receiver.name,
-                'sender_lb': rec.sender.lb_username,
-                'receiver_lb': rec.receiver.lb_username,
-                'sender_id': d_sender.id,
-                'receiver_id': d_receiver.id,
-                'film_title': rec.recomm,
-                'film_id': rec.recomm_identifier,
-                'review_link': review_link,
-                'review_rating': review_rating
+                roll_msg.write(f'{sender_name} » {receiver_name} | <b>{movie}</b> ({year}) | <a href="{review.url}">Review</a>\n')
+            else:
+                roll_msg.write(f'{sender_name} » {receiver_name} | <b>{movie}</b> ({year})\n')
+            sender_link = linkify_user(d_sender.name, rec.sender.lb_username)
+            receiver_link = linkify_user(d_receiver.name, rec.receiver.lb_username)
+            description = f'{sender_link} » {receiver_link}'
+            if review:
+                description += f' <a href="{review.url}">Link to review</a>'
+            else:
+                if with_reviews:
+                    csv_naughty.writerow({
+                        'naughty_user': d_receiver.name,
+                        'naughty_user_id': d_receiver.id,
+                        'recommendation': rec.recomm,
+                        'sender': d_sender.name,
+                    })
+            csv_writer.writerow({
+                "Position": position,
+                "Name": movie,
+                "Year": year,
+                "Description": description
             })
+            if with_reviews:
+                review = review_map.get(review_key(rec))
+                review_link = None
+                review_rating = None
+                if review:
+                    review_link = review.url
+                    review_rating = review.rating
+                csv_review_writer.writerow({
+                    'sender': d_sender.name,
+                    'receiver': d_receiver.name,
+                    'sender_lb': rec.sender.lb_username,
+                    'receiver_lb': rec.receiver.lb_username,
+                    'sender_id': d_sender.id,
+                    'receiver_id': d_receiver.id,
+                    'film_title': rec.recomm,
+                    'film_id': rec.recomm_identifier,
+                    'review_link': review_link,
+                    'review_rating': review_rating
+                })
 
-    csv_content.seek(0)
-    await ctx.channel.send("", file=discord.File(StringIO(roll_msg), "recs.txt"))
-    await ctx.channel.send("", file=discord.File(csv_content, "recs.csv"))
-    if with_reviews:
-        csv_review_content.seek(0)
-        await ctx.channel.send("", file=discord.File(csv_review_content, "backup.csv"))
-        naughty_users.seek(0)
-        await ctx.channel.send("", file=discord.File(naughty_users, "naughtylist.csv"))
+        await send_exports(ctx.channel, exports)
+    finally:
+        for export in exports:
+            export.close()
 
 
 @bot.command(name='warn-mia')
@@ -613,30 +648,25 @@ async def warn_mia(ctx):
     """
     Warn people who are MIA by pinging them.
     """
-    # TODO: handle 2000 character limit
-    raffle_role = ctx.guild.get_role(raffle_role_id)
     raffle_channel = bot.get_channel(raffle_channel_id)
-    message = '**Please provide film raffle recommendations to your raffle partner**\n\n'
-
-    for member in raffle_role.members:
-        message += f'{member.mention}\n'
-        if len(message) > 1950:
-            await raffle_channel.send(message)
-            message = ''
-    if len(message) > 0:
-        await raffle_channel.send(message)
+    report = await MIAReport.build(db, ctx.guild, bot.members)
+    lines = ['**Please provide film raffle recommendations to your raffle partner**', '']
+    # in ring order, so the pings come out the same every time
+    lines += [f'<@{entry.sender_id}>' for entry in report.entries if entry.sender_id in report.pending_in_server]
+    await send_packed(raffle_channel, lines)
 
 
 @bot.command(name='f', aliases=['film', 'kino', 'F'])
 @only_in_raffle_channel()
 async def recc_intercept(ctx, *, movie_query):
-    if not (await db.get_guild(ctx.guild.id)).raffle_rolled:
+    guild_state = await db.get_guild_state(ctx.guild.id)
+    if guild_state is None or not guild_state.raffle_rolled:
         return
     movie_title = ''
     url = None
     raffle_channel = bot.get_channel(raffle_channel_id)
     try:
-        movie_title, url = await get_movie_title(movie_query)
+        movie_title, url = await film_titles.resolve(bot.lb_session, movie_query)
     except Exception as e:
         logger.error(f"error occured while getting '{movie_query}'")
 
@@ -645,15 +675,17 @@ async def recc_intercept(ctx, *, movie_query):
         return
 
     raffle_role = ctx.guild.get_role(raffle_role_id)
-    raffle_entry = await db.get_raffle_entry_by_sender(ctx.guild.id, ctx.author.id)
+    async with db.unit_of_work():
+        raffle_entry = await db.get_raffle_entry_by_sender(ctx.guild.id, ctx.author.id)
+        if raffle_entry is not None:
+            await db.recomm_movie(ctx.guild.id, ctx.author.id, movie_title, url)
     if raffle_entry is None:
         # this person is not part of the raffle
         await raffle_channel.send(f"Who are you. I don't know you. Sign up for raffle before rolling next time. smh.")
         return
-    await ctx.author.remove_roles(raffle_role)
-    await db.recomm_movie(ctx.guild.id, ctx.author.id, movie_title, url)
-    sender = ctx.guild.get_member(int(raffle_entry.sender_id))
-    receiver = ctx.guild.get_member(int(raffle_entry.receiver_id))
+    await bot.role_scheduler.apply(ctx.author, raffle_role, REMOVE)
+    sender = await bot.members.get(ctx.guild, raffle_entry.sender_id)
+    receiver = await bot.members.get(ctx.guild, raffle_entry.receiver_id)
     if receiver is None:
         await raffle_channel.send(f"Your raffle partner seems to have left the server. Guess they don't like you. Don't worry, I do :). So sit tight and wait for the re-rolling tomorrow.")
         return
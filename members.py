@@ -0,0 +1,146 @@
+import asyncio
+import logging
+
+import discord
+
+logger = logging.getLogger('raffle_bot.members')
+
+# every member is chunked at startup and kept, discord.py's default
+POLICY_FULL = 'full'
+# only raffle participants, signups and privileged members are kept, see MemberCache
+POLICY_RAFFLE = 'raffle'
+
+# user ids per gateway member request, discord's limit
+QUERY_CHUNK_SIZE = 100
+
+
+def client_options(policy):
+    """
+    Keyword arguments for the bot's constructor under the given member cache policy.
+    """
+    if policy == POLICY_FULL:
+        return {}
+    if policy != POLICY_RAFFLE:
+        raise ValueError(f'unknown member cache policy {policy!r}')
+    return dict(
+        chunk_guilds_at_startup=False,
+        # members whose roles we change come back in GUILD_MEMBER_UPDATE and get cached
+        member_cache_flags=discord.MemberCacheFlags(online=False, voice=False, joined=True),
+    )
+
+
+class MemberCache:
+    """
+    Keeps the members the raffle needs in discord.py's member cache.
+
+    Under the `full` policy every member is already cached and this does nothing. Under
+    `raffle` the guilds are not chunked at startup: `warm` requests the raffle participants,
+    the signups (users who reacted to the signup message) and users with pending role tasks
+    over the gateway, `ensure` requests anyone else on demand, and `prune` periodically
+    drops cached members holding neither the raffle role nor a privileged role and not
+    asked for since the last warm.
+    """
+
+    def __init__(self, bot, db, policy=POLICY_FULL, raffle_role_id=None,
+                 privileged_role_ids=(), prune_interval=600):
+        self.bot = bot
+        self.db = db
+        self.policy = policy
+        self.raffle_role_id = raffle_role_id
+        self.keep_role_ids = frozenset(privileged_role_ids) | {raffle_role_id}
+        self.prune_interval = prune_interval
+        # guild_id -> user ids asked for since the last warm
+        self._wanted = {}
+        self._prune_task = None
+
+    @property
+    def lazy(self):
+        return self.policy == POLICY_RAFFLE
+
+    def start(self):
+        if self.lazy and self._prune_task is None:
+            self._prune_task = asyncio.create_task(self._prune_loop())
+
+    async def close(self):
+        if self._prune_task is not None:
+            self._prune_task.cancel()
+            self._prune_task = None
+
+    async def _signup_ids(self, guild):
+        guild_state = await self.db.get_guild_state(guild.id)
+        if guild_state is None or guild_state.raffle_message_id is None:
+            return set()
+        channel = guild.get_channel(self.bot.raffle_channel_id)
+        if channel is None:
+            return set()
+        try:
+            message = await channel.fetch_message(guild_state.raffle_message_id)
+        except discord.HTTPException as e:
+            logger.warning(f'could not fetch signup message of guild={guild.id}: {e}')
+            return set()
+        user_ids = set()
+        for reaction in message.reactions:
+            if reaction.emoji == self.bot.emoji_for_role.name:
+                async for user in reaction.users(limit=None):
+                    user_ids.add(user.id)
+        return user_ids
+
+    async def warm(self, guild):
+        """Caches the members the raffle currently needs"""
+        if not self.lazy:
+            return
+        self._wanted[guild.id] = set()
+        user_ids = await self._signup_ids(guild)
+        for entry in await self.db.get_all_reccs(guild.id):
+            user_ids.update((entry.sender_id, entry.receiver_id))
+        user_ids.update(task.user_id for task in await self.db.get_role_tasks(guild.id))
+        await self.ensure(guild, user_ids)
+        logger.info(f'guild={guild.id}: {len(guild.members)} members cached after warm up')
+
+    async def ensure(self, guild, user_ids):
+        """
+        Makes sure every member of `user_ids` still in the guild is cached.
+        """
+        if not self.lazy:
+            return
+        user_ids = set(user_ids)
+        self._wanted.setdefault(guild.id, set()).update(user_ids)
+        missing = [user_id for user_id in user_ids if guild.get_member(user_id) is None]
+        for i in range(0, len(missing), QUERY_CHUNK_SIZE):
+            chunk = missing[i:i + QUERY_CHUNK_SIZE]
+            try:
+                await guild.query_members(user_ids=chunk, limit=len(chunk), cache=True)
+            except asyncio.TimeoutError:
+                logger.warning(f'timed out requesting {len(chunk)} members of guild={guild.id}')
+
+    async def get(self, guild, user_id):
+        """`guild.get_member`, requesting the member if they are not cached"""
+        member = guild.get_member(user_id)
+        if member is None and self.lazy:
+            await self.ensure(guild, [user_id])
+            member = guild.get_member(user_id)
+        return member
+
+    def prune(self, guild):
+        """Drops cached members the raffle doesn't need, returns how many"""
+        if not self.lazy:
+            return 0
+        wanted = self._wanted.get(guild.id, set())
+        pruned = 0
+        for member in list(guild.members):
+            if member.id == self.bot.user.id or member.id in wanted:
+                continue
+            # Member._roles holds the member's role ids
+            if not self.keep_role_ids.isdisjoint(member._roles):
+                continue
+            guild._remove_member(member)
+            pruned += 1
+        return pruned
+
+    async def _prune_loop(self):
+        while True:
+            await asyncio.sleep(self.prune_interval)
+            for guild in self.bot.guilds:
+                pruned = self.prune(guild)
+                if pruned:
+                    logger.info(f'guild={guild.id}: pruned {pruned} members, {len(guild.members)} left')
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+import discord
+
+logger = logging.getLogger('raffle_bot.messaging')
+
+MESSAGE_LIMIT = 2000
+EMBED_DESCRIPTION_LIMIT = 4096
+
+
+def pack_lines(lines, limit=MESSAGE_LIMIT):
+    """
+    Joins lines with newlines into as few chunks of at most `limit` characters as possible.
+    Lines are only broken up when a single line is longer than `limit`.
+    """
+    chunks = []
+    current = ''
+    for line in lines:
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if not current:
+            current = line
+        elif len(current) + 1 + len(line) <= limit:
+            current += '\n' + line
+        else:
+            chunks.append(current)
+            current = line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def silent_pin_message(message: discord.Message):
+    try:
+        await message.pin()
+    except discord.Forbidden:
+        logger.warning("don't have perms for pinning message")
+
+
+async def send_packed(channel, lines, embed=False, pin=False, pin_concurrency=5):
+    """
+    Sends `lines` in as few messages as possible and returns the messages.
+
+    Messages go out one after the other so they stay in order. Pins are started as soon as
+    each message is sent and run alongside the remaining sends, at most `pin_concurrency`
+    at a time. With `embed` the text goes into embed descriptions, which fit about twice as
+    much per message, but mentions inside embeds don't notify anyone.
+    """
+    limit = EMBED_DESCRIPTION_LIMIT if embed else MESSAGE_LIMIT
+    semaphore = asyncio.Semaphore(pin_concurrency)
+    pin_tasks = []
+    messages = []
+
+    async def bounded_pin(message):
+        async with semaphore:
+            await silent_pin_message(message)
+
+    for chunk in pack_lines(lines, limit):
+        if embed:
+            message = await channel.send(embed=discord.Embed(description=chunk))
+        else:
+            message = await channel.send(chunk)
+        messages.append(message)
+        if pin:
+            pin_tasks.append(asyncio.create_task(bounded_pin(message)))
+    if pin_tasks:
+        await asyncio.wait(pin_tasks)
+    return messages
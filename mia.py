@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+import discord
+
+logger = logging.getLogger('raffle_bot.mia')
+
+
+class MIAReport:
+    """
+    Who is missing in action in the current round.
+
+    `pending_ids` still owe a recommendation, `left_ids` are participants no longer in the
+    server. Both are plain set operations over the raffle entries and a snapshot of the
+    guild's member ids.
+    """
+
+    def __init__(self, entries, member_ids):
+        # raffle entries, in ring order
+        self.entries = entries
+        sender_ids = {entry.sender_id for entry in entries}
+        self.pending_ids = {entry.sender_id for entry in entries if entry.recomm is None}
+        self.left_ids = sender_ids - member_ids
+        self.mia_ids = self.pending_ids | self.left_ids
+
+    @classmethod
+    async def build(cls, db, guild, members=None):
+        """`members` is the bot's members.MemberCache, participants not cached are requested first"""
+        entries = await db.get_all_reccs(guild.id)
+        if members is not None:
+            await members.ensure(guild, [entry.sender_id for entry in entries])
+        member_ids = {member.id for member in guild.members}
+        report = cls(entries, member_ids)
+        logger.info(f'guild={guild.id}: {len(report.pending_ids)} pending, {len(report.left_ids)} left the server')
+        return report
+
+    @property
+    def pending_in_server(self):
+        """MIA users who can still be pinged"""
+        return self.pending_ids - self.left_ids
+
+
+class NameResolver:
+    """
+    Resolves user ids to names: cached members first, then `bot.fetch_user`, at most
+    `concurrency` fetches at a time. Names (and unknown ids, as None) are kept in an LRU.
+    """
+
+    def __init__(self, bot, concurrency=5, max_size=4096):
+        self.bot = bot
+        self.max_size = max_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # user_id -> name, None for deleted accounts
+        self._names = OrderedDict()
+
+    def _put(self, user_id, name):
+        self._names[user_id] = name
+        self._names.move_to_end(user_id)
+        while len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+
+    async def _fetch(self, user_id):
+        async with self._semaphore:
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except discord.NotFound:
+                self._put(user_id, None)
+                return
+            except discord.HTTPException as e:
+                logger.warning(f'could not fetch user={user_id}: {e}')
+                return
+        self._put(user_id, user.name)
+
+    async def resolve(self, guild, user_ids):
+        """
+        Returns a user_id -> name dict. Ids which could not be resolved are left out.
+        """
+        missing = []
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            if member is not None:
+                self._put(user_id, member.name)
+            elif user_id not in self._names:
+                missing.append(user_id)
+        if missing:
+            await asyncio.gather(*(self._fetch(user_id) for user_id in missing))
+        return {
+            user_id: self._names[user_id]
+            for user_id in user_ids if self._names.get(user_id) is not None
+        }
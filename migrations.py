@@ -0,0 +1,230 @@
+"""
+Schema migrations, run from Database.init.
+
+The version of the last migration applied is kept in the SchemaVersion table. A fresh
+database is created straight from the models at the latest version, an existing one runs
+every migration newer than its version, in order. Migrations get a sync connection (they
+run under `AsyncConnection.run_sync`) and the metadata of the current models.
+"""
+import logging
+
+from sqlalchemy import inspect, select, update, delete, text, bindparam, Integer, BigInteger, MetaData, Table, Column, ForeignKey, UniqueConstraint
+
+logger = logging.getLogger('raffle_bot.db')
+
+# tables holding discord ids, parents before children
+ID_TABLES = ['User', 'Guild', 'Raffle', 'NaughtyList']
+
+# suffixes of the tables migration 1 copies into and moves the originals out to
+NEW_SUFFIX = '__new'
+OLD_SUFFIX = '__old'
+
+
+def _copy_table(table, metadata, suffix):
+    """
+    Copy of `table` named `table.name + suffix`, with foreign keys to ID_TABLES pointing at
+    their suffixed copies, and the same unique constraints. Indexes are left out, their
+    names are taken by the originals.
+    """
+    columns = []
+    for column in table.columns:
+        foreign_keys = [
+            ForeignKey(f'{fk.column.table.name}{suffix}.{fk.column.name}')
+            for fk in column.foreign_keys
+        ]
+        columns.append(Column(column.name, column.type, *foreign_keys, primary_key=column.primary_key,
+                              nullable=column.nullable, autoincrement=column.autoincrement))
+    # Column(unique=True) shows up here too
+    uniques = [
+        UniqueConstraint(*[column.name for column in constraint.columns])
+        for constraint in table.constraints if isinstance(constraint, UniqueConstraint)
+    ]
+    return Table(table.name + suffix, metadata, *columns, *uniques)
+
+
+def _rename_constraints(conn, name):
+    """
+    Postgres and cockroach name constraints after the table they were created on, so the
+    copy's "User__new_pkey" becomes "User_pkey" as create_all would have named it.
+    """
+    inspector = inspect(conn)
+    names = [inspector.get_pk_constraint(name)['name']]
+    names += [constraint['name'] for constraint in inspector.get_unique_constraints(name)]
+    names += [constraint['name'] for constraint in inspector.get_foreign_keys(name)]
+    prefix = name + NEW_SUFFIX
+    for constraint in names:
+        if constraint and constraint.startswith(prefix):
+            renamed = name + constraint[len(prefix):]
+            conn.execute(text(f'ALTER TABLE "{name}" RENAME CONSTRAINT "{constraint}" TO "{renamed}"'))
+
+
+def _swap_tables(conn, metadata):
+    """
+    Moves the originals out of the way, moves the copies into place, then drops the originals
+    and recreates the indexes. Safe to rerun, a previous run may have stopped at any step.
+    """
+    existing = set(inspect(conn).get_table_names())
+    for name in ID_TABLES:
+        if name in existing and name + NEW_SUFFIX in existing:
+            conn.execute(text(f'ALTER TABLE "{name}" RENAME TO "{name}{OLD_SUFFIX}"'))
+    for name in ID_TABLES:
+        if name + NEW_SUFFIX in existing:
+            conn.execute(text(f'ALTER TABLE "{name}{NEW_SUFFIX}" RENAME TO "{name}"'))
+    existing = set(inspect(conn).get_table_names())
+    for name in ID_TABLES:
+        if name + OLD_SUFFIX in existing:
+            old_count = conn.execute(text(f'SELECT count(*) FROM "{name}{OLD_SUFFIX}"')).scalar()
+            new_count = conn.execute(text(f'SELECT count(*) FROM "{name}"')).scalar()
+            if old_count != new_count:
+                raise RuntimeError(f'{name} has {new_count} rows but the original {old_count}, '
+                                   f'keeping "{name}{OLD_SUFFIX}" for inspection')
+    for name in reversed(ID_TABLES):
+        if name + OLD_SUFFIX in existing:
+            conn.execute(text(f'DROP TABLE "{name}{OLD_SUFFIX}"'))
+    for name in ID_TABLES:
+        if conn.dialect.name != 'sqlite':
+            _rename_constraints(conn, name)
+        indexes = {index['name'] for index in inspect(conn).get_indexes(name)}
+        for index in metadata.tables[name].indexes:
+            if index.name not in indexes:
+                index.create(conn)
+
+
+def _bigint_ids(conn, metadata):
+    """
+    Text ids -> BigInteger ids, plus the Raffle and NaughtyList indexes.
+
+    ALTER COLUMN TYPE on columns tied together by foreign keys is handled differently by
+    postgres and cockroach, so the rows are copied into converted tables created next to
+    the originals, which are then swapped in by renaming. The originals are only dropped
+    once the copies hold every row; with cockroach's autocommit_before_ddl each statement
+    commits on its own, so a run that fails part way leaves the data intact and is picked
+    up where it stopped by the next start.
+    """
+    existing = set(inspect(conn).get_table_names())
+    if any(name + OLD_SUFFIX in existing for name in ID_TABLES):
+        # stopped while swapping, the copies are complete
+        _swap_tables(conn, metadata)
+        return
+    columns = {c['name']: c for c in inspect(conn).get_columns('User')}
+    if isinstance(columns['user_id']['type'], (Integer, BigInteger)):
+        return
+
+    tables = [name for name in ID_TABLES if name in existing]
+    # everything is converted before touching the schema, a bad id fails the migration here
+    converted = {}
+    for name in tables:
+        table = metadata.tables[name]
+        rows = []
+        for row in conn.execute(text(f'SELECT * FROM "{name}"')):
+            try:
+                rows.append({
+                    key: int(value) if key.endswith('_id') and value is not None else value
+                    for key, value in row._mapping.items() if key in table.c
+                })
+            except ValueError:
+                raise RuntimeError(f'{name} row {dict(row._mapping)} has a non numeric id, fix it and restart')
+        converted[name] = rows
+
+    # leftovers of a run which stopped while copying
+    for name in reversed(ID_TABLES):
+        if name + NEW_SUFFIX in existing:
+            conn.execute(text(f'DROP TABLE "{name}{NEW_SUFFIX}"'))
+
+    copies = MetaData()
+    for name in ID_TABLES:
+        _copy_table(metadata.tables[name], copies, NEW_SUFFIX)
+    copies.create_all(conn)
+    for name in tables:
+        if converted[name]:
+            conn.execute(copies.tables[name + NEW_SUFFIX].insert(), converted[name])
+        logger.info(f'copied {len(converted[name])} rows of {name} with integer ids')
+
+    _swap_tables(conn, metadata)
+
+
+def _raffle_position(conn, metadata):
+    """
+    Adds Raffle.position and numbers existing entries by walking each guild's ring once.
+    """
+    table = metadata.tables['Raffle']
+    columns = {c['name'] for c in inspect(conn).get_columns('Raffle')}
+    if 'position' not in columns:
+        conn.execute(text('ALTER TABLE "Raffle" ADD COLUMN position INTEGER'))
+    indexes = {index['name'] for index in inspect(conn).get_indexes('Raffle')}
+    for index in table.indexes:
+        if index.name not in indexes:
+            index.create(conn)
+
+    rings = {}
+    for row in conn.execute(select(table.c.guild_id, table.c.sender_id, table.c.receiver_id)):
+        rings.setdefault(row.guild_id, {})[row.sender_id] = row.receiver_id
+
+    updates = []
+    for guild_id, entry_map in rings.items():
+        position = 0
+        visited = set()
+        # a broken ring is numbered chain by chain
+        for start in entry_map:
+            curr = start
+            while curr in entry_map and curr not in visited:
+                visited.add(curr)
+                updates.append(dict(g=guild_id, s=curr, p=position))
+                position += 1
+                curr = entry_map[curr]
+    if updates:
+        conn.execute(
+            update(table)
+            .where(table.c.guild_id == bindparam('g'), table.c.sender_id == bindparam('s'))
+            .values(position=bindparam('p')),
+            updates)
+    logger.info(f'numbered {len(updates)} raffle entries')
+
+
+def _drop_unrecommended_index(conn, metadata):
+    """
+    Drops the partial index on Raffle's unrecommended entries, mia.MIAReport reads every entry.
+    """
+    indexes = {index['name'] for index in inspect(conn).get_indexes('Raffle')}
+    if 'ix_raffle_guild_unrecommended' in indexes:
+        conn.execute(text('DROP INDEX ix_raffle_guild_unrecommended'))
+
+
+# (version, migration), in order
+MIGRATIONS = [
+    (1, _bigint_ids),
+    (2, _raffle_position),
+    (3, _drop_unrecommended_index),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _set_version(conn, metadata, version):
+    table = metadata.tables['SchemaVersion']
+    conn.execute(delete(table))
+    conn.execute(table.insert().values(version=version))
+
+
+def upgrade(conn, metadata):
+    existing = set(inspect(conn).get_table_names())
+    if not existing & {'User', 'User' + NEW_SUFFIX, 'User' + OLD_SUFFIX}:
+        # fresh database
+        metadata.create_all(conn)
+        _set_version(conn, metadata, LATEST_VERSION)
+        return
+
+    version_table = metadata.tables['SchemaVersion']
+    version = 0
+    if 'SchemaVersion' in existing:
+        version = conn.execute(select(version_table.c.version)).scalar() or 0
+    else:
+        version_table.create(conn)
+
+    for number, migration in MIGRATIONS:
+        if number > version:
+            logger.info(f'running migration {number}: {migration.__name__}')
+            migration(conn, metadata)
+            _set_version(conn, metadata, number)
+
+    # tables added since, which need no data migration
+    metadata.create_all(conn)
@@ -1,39 +1,127 @@
-from typing import List
-import discord
-from .db import Raffle
+import random
+from typing import Hashable, Iterable, List, Tuple
+
+
+def ring_pairs(ring: List[Hashable]) -> List[Tuple[Hashable, Hashable]]:
+    """
+    (sender, receiver) pairs of a ring: every user sends to the next one, the last to the first.
+    """
+    return [(ring[i], ring[(i + 1) % len(ring)]) for i in range(len(ring))]
 
 
 class FilmRaffle:
-    def __init__(self, db, guild):
-        self.db = db
-        self.guild_id = guild
+    """
+    Pairing engine for a raffle round.
+
+    Builds a single ring over the participants which avoids the (sender, receiver) pairs in
+    `forbidden`, typically the pairings of the last few rounds plus per user exclusions.
+
+    The ring starts out as a shuffle. Every forbidden edge is then repaired by swapping its
+    receiver with a random participant, accepting the swap only if all the edges it touches
+    are allowed. Each edge gets at most `attempts` tries; when none works the edge is kept
+    and counted as a violation, so crowded constraints relax instead of retrying forever.
+    That is O(n * attempts) set lookups in the worst case and O(n) when few edges clash.
+    """
+
+    def __init__(self, forbidden: Iterable[Tuple[Hashable, Hashable]] = (), attempts=30, rng=None):
+        self.forbidden = set(forbidden)
+        self.attempts = attempts
+        self.rng = rng or random.Random()
 
-    async def rolled(self):
-        await guild = self.db.get_guild(self.guild_id)
-        return guild.raffle_rolled
+    def allowed(self, sender, receiver):
+        return sender != receiver and (sender, receiver) not in self.forbidden
 
-    def create_random_mapping(self, users: List[discord.User]):
+    def _edges_ok(self, ring, positions):
+        n = len(ring)
+        for pos in positions:
+            if not self.allowed(ring[pos], ring[(pos + 1) % n]):
+                return False
+        return True
+
+    def build_ring(self, users: Iterable[Hashable]):
+        """
+        Returns (ring, violations), `violations` being the number of forbidden pairings
+        which could not be avoided.
         """
-        Creates a random mapping between users
+        ring = list(users)
+        self.rng.shuffle(ring)
+        n = len(ring)
+        if n < 3:
+            # nothing to rearrange
+            return ring, sum(1 for pair in ring_pairs(ring) if pair in self.forbidden)
+
+        for i in range(n):
+            a = (i + 1) % n
+            if self.allowed(ring[i], ring[a]):
+                continue
+            for _ in range(self.attempts):
+                b = self.rng.randrange(n)
+                if b == a:
+                    continue
+                ring[a], ring[b] = ring[b], ring[a]
+                # edges leaving the positions before and at both swapped slots
+                if self._edges_ok(ring, {(a - 1) % n, a, (b - 1) % n, b}):
+                    break
+                ring[a], ring[b] = ring[b], ring[a]
+
+        violations = sum(1 for sender, receiver in ring_pairs(ring) if not self.allowed(sender, receiver))
+        return ring, violations
 
-        This creates a ring of users. The algo does this by shuffling the user list
-        and adding an edge from ith user to i+1 th user if i!=n. For the last user, an edge
-        is added to the first user.
+
+class Ring:
+    """
+    Doubly linked ring of user ids, backed by arrays indexed by slot.
+
+    Removing k users touches only their neighbours, so a reroll costs O(k) on top of
+    building the ring, whatever the number of participants.
+    """
+
+    def __init__(self, users: Iterable[Hashable]):
+        self._ids = list(users)
+        n = len(self._ids)
+        self._slots = {uid: slot for slot, uid in enumerate(self._ids)}
+        self._next = [(slot + 1) % n for slot in range(n)]
+        self._prev = [(slot - 1) % n for slot in range(n)]
+        self._alive = [True] * n
+        self._head = 0
+        self._size = n
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, uid):
+        return uid in self._slots
+
+    def __iter__(self):
+        slot = self._head
+        for _ in range(self._size):
+            yield self._ids[slot]
+            slot = self._next[slot]
+
+    def remove(self, user_ids: Iterable[Hashable]) -> List[Tuple[Hashable, Hashable]]:
         """
-        # users would be Discord usernames
-        random.shuffle(users)
-        randomized_list = []
-        for i in range(len(users)-1):
-            randomized_list.append((users[i], users[i+1]))
-        randomized_list.append((users[-1], users[0]))
-        return randomized_list
-
-    def start_raffle(self, users: List[discord.User]):
-        rando_list = self.create_random_mapping(users)
-        await self.db.add_raffle_entries([
-            Raffle(guild_id=str(guild.id), sender_id=str(pair[0].id), receiver_id=str(pair[1].id), recomm=None)
-            for pair in rando_list
-        ])
-        return rando_list
-
-    def reroll(self, mia_users: List[int]):
+        Splices `user_ids` out of the ring and returns the new (sender, receiver) edges,
+        one per run of consecutive removed users. Ids not in the ring are ignored.
+        """
+        touched = []
+        for uid in user_ids:
+            slot = self._slots.pop(uid, None)
+            if slot is None:
+                continue
+            prev, next_ = self._prev[slot], self._next[slot]
+            self._next[prev] = next_
+            self._prev[next_] = prev
+            self._alive[slot] = False
+            self._size -= 1
+            if slot == self._head:
+                self._head = next_
+            touched.append(prev)
+
+        edges = []
+        seen = set()
+        for slot in touched:
+            # the neighbour may have been removed later on, its own neighbour is touched then
+            if self._alive[slot] and slot not in seen:
+                seen.add(slot)
+                edges.append((self._ids[slot], self._ids[self._next[slot]]))
+        return edges
@@ -0,0 +1,146 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger('raffle_bot.reactions')
+
+
+class ReactionCoalescer:
+    """
+    Buffers signup reaction events per (guild, user) for `window` seconds.
+
+    People unreact and react again on the signup message, often several times in a row.
+    Only the last event seen for a user in the window is passed to `handler(payload, added)`,
+    so a remove followed by an add does the work of a single add.
+    """
+
+    def __init__(self, handler, window=2.0):
+        self.handler = handler
+        self.window = window
+        # (guild_id, user_id) -> [payload, added]
+        self._pending = {}
+        self.coalesced = 0
+
+    def push(self, payload, added):
+        key = (payload.guild_id, payload.user_id)
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending[0] = payload
+            pending[1] = added
+            self.coalesced += 1
+            return
+        self._pending[key] = [payload, added]
+        asyncio.get_event_loop().call_later(self.window, self._flush, key)
+
+    def _flush(self, key):
+        payload, added = self._pending.pop(key)
+        asyncio.create_task(self._run(payload, added))
+
+    async def _run(self, payload, added):
+        try:
+            await self.handler(payload, added)
+        except Exception:
+            logger.exception(f'error handling reaction of user={payload.user_id}')
+
+
+class ReactionQueue:
+    """
+    Per guild bounded queue of reaction work, drained by `workers` tasks per guild.
+
+    Bounds how many reactions are being handled at once (db sessions, role calls) no matter
+    how large the signup burst. Once a guild's backlog reaches `max_size`, new work is
+    deferred by `defer_delay` seconds, and dropped after `max_defers` deferrals.
+
+    Each worker has its own queue and a user's work always goes to the same one, so one
+    user's reactions are handled one at a time and in order. Work superseded by a newer
+    submission for the same user while it was deferred or queued is skipped.
+    """
+
+    def __init__(self, handler, workers=4, max_size=200, defer_delay=5.0, max_defers=3):
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.defer_delay = defer_delay
+        self.max_defers = max_defers
+        # guild_id -> one asyncio.Queue per worker
+        self._queues = {}
+        self._tasks = []
+        # (guild_id, user_id) -> sequence number of the latest submission
+        self._latest = {}
+        self._seq = itertools.count()
+        # seconds spent queued, for the last few hundred items
+        self._waits = deque(maxlen=500)
+
+        self.processed = 0
+        self.deferred = 0
+        self.shed = 0
+        self.superseded = 0
+
+    def _queue_for(self, guild_id, user_id):
+        queues = self._queues.get(guild_id)
+        if queues is None:
+            size = max(1, self.max_size // self.workers)
+            queues = [asyncio.Queue(maxsize=size) for _ in range(self.workers)]
+            self._queues[guild_id] = queues
+            self._tasks += [asyncio.create_task(self._worker(queue)) for queue in queues]
+        return queues[user_id % self.workers]
+
+    async def submit(self, payload, added):
+        seq = next(self._seq)
+        self._latest[(payload.guild_id, payload.user_id)] = seq
+        self._enqueue(seq, payload, added, 0)
+
+    def _enqueue(self, seq, payload, added, defers):
+        queue = self._queue_for(payload.guild_id, payload.user_id)
+        if not queue.full():
+            queue.put_nowait((time.monotonic(), seq, payload, added))
+            return
+        if defers >= self.max_defers:
+            self.shed += 1
+            if self._latest.get((payload.guild_id, payload.user_id)) == seq:
+                del self._latest[(payload.guild_id, payload.user_id)]
+            logger.warning(f'reaction backlog full, dropping reaction of user={payload.user_id}')
+            return
+        self.deferred += 1
+        asyncio.get_event_loop().call_later(
+            self.defer_delay, self._enqueue, seq, payload, added, defers + 1)
+
+    async def _worker(self, queue):
+        while True:
+            enqueued_at, seq, payload, added = await queue.get()
+            self._waits.append(time.monotonic() - enqueued_at)
+            key = (payload.guild_id, payload.user_id)
+            try:
+                if self._latest.get(key) != seq:
+                    # a newer reaction of the user is on its way
+                    self.superseded += 1
+                    continue
+                await self.handler(payload, added)
+            except Exception:
+                logger.exception(f'error handling reaction of user={payload.user_id}')
+            finally:
+                if self._latest.get(key) == seq:
+                    del self._latest[key]
+                self.processed += 1
+                queue.task_done()
+
+    def stats(self):
+        waits = list(self._waits)
+        return {
+            'depth': sum(queue.qsize() for queues in self._queues.values() for queue in queues),
+            'processed': self.processed,
+            'deferred': self.deferred,
+            'shed': self.shed,
+            'superseded': self.superseded,
+            'mean_wait_s': round(sum(waits) / len(waits), 3) if waits else 0,
+            'max_wait_s': round(max(waits), 3) if waits else 0,
+        }
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+        self._tasks = []
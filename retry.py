@@ -0,0 +1,28 @@
+import asyncio
+
+import aiohttp
+import discord
+
+
+def discord_retryable(e):
+    """Rate limited or a discord server error"""
+    return isinstance(e, discord.HTTPException) and (e.status == 429 or e.status >= 500)
+
+
+def http_retryable(e):
+    """Network errors and timeouts, including the 429s and 5xxs raised by raise_for_status"""
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+async def with_retries(call, retryable, retries=3, backoff=1.0):
+    """
+    Returns `await call()`, retrying with exponential backoff while `retryable(exception)`
+    holds. The last exception is raised once `retries` retries have been used up.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if not retryable(e) or attempt == retries:
+                raise
+            await asyncio.sleep(backoff * 2 ** attempt)
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+
+import aiohttp
+
+from lb_bot import get_user_review
+from retry import with_retries, http_retryable
+
+logger = logging.getLogger('raffle_bot.reviews')
+
+
+def review_key(rec):
+    """
+    (receiver lb username, film) pair identifying the review a raffle entry expects.
+    None if the receiver has no lb username.
+    """
+    if not rec.receiver.lb_username:
+        return None
+    return rec.receiver.lb_username.strip(), rec.recomm_identifier or rec.recomm
+
+
+class ReviewVerifier:
+    """
+    Checks whether receivers reviewed the film they were recommended.
+
+    Lookups are deduplicated per (receiver, film), run with at most `concurrency` requests
+    against Letterboxd at once and retried with exponential backoff on network errors,
+    429s and 5xxs.
+    """
+
+    def __init__(self, session, film_titles, concurrency=8, retries=3, backoff=1.0, with_rating=False):
+        self.session = session
+        self.film_titles = film_titles
+        self.with_rating = with_rating
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _fetch(self, rec):
+        key = review_key(rec)
+
+        async def lookup():
+            film_id = rec.recomm_identifier
+            if not film_id:
+                # entries from before identifiers were stored only have the title
+                _, film_id = await self.film_titles.resolve(self.session, rec.recomm)
+                if not film_id:
+                    return None
+            return await get_user_review(self.session, key[0], film_id, self.with_rating)
+
+        async with self._semaphore:
+            try:
+                return key, await with_retries(lookup, http_retryable, self.retries, self.backoff)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f'giving up on review {key}: {e}')
+                return key, None
+
+    async def verify(self, recs):
+        """
+        Async generator yielding (review_key, FilmReview or None) as each lookup finishes.
+        """
+        unique = {}
+        for rec in recs:
+            key = review_key(rec)
+            if key is not None and key not in unique:
+                unique[key] = rec
+        logger.info(f'verifying {len(unique)} reviews for {len(recs)} entries')
+
+        tasks = [asyncio.ensure_future(self._fetch(rec)) for rec in unique.values()]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:
+                task.cancel()
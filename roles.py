@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+import discord
+
+from retry import with_retries, discord_retryable
+
+logger = logging.getLogger('raffle_bot.roles')
+
+ADD = 'add'
+REMOVE = 'remove'
+
+# completed tasks are removed from the queue table in batches of this size
+CHECKPOINT_EVERY = 100
+
+
+class RoleScheduler:
+    """
+    Applies role changes with bounded concurrency, retrying 429s and 5xxs.
+
+    Bulk jobs (`run`) are written to the RoleTask table before any API call and tasks are
+    removed as they complete, so a job cut short by a restart is finished by `resume`
+    instead of starting over. Tasks which fail stay queued and are retried by `resume` or
+    the next job for the same role and action. Progress is reported to the debug channel.
+    """
+
+    def __init__(self, bot, db, concurrency=5, retries=3, backoff=1.0,
+                 debug_channel_id=None, progress_every=500):
+        self.bot = bot
+        self.db = db
+        self.retries = retries
+        self.backoff = backoff
+        self.debug_channel_id = debug_channel_id
+        self.progress_every = progress_every
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def apply(self, member, role, action):
+        """
+        Adds or removes a single role. Returns False if it could not be done.
+        """
+        change = member.add_roles if action == ADD else member.remove_roles
+        async with self._semaphore:
+            try:
+                await with_retries(lambda: change(role), discord_retryable, self.retries, self.backoff)
+                return True
+            except discord.HTTPException as e:
+                logger.error(f'could not {action} role={role.id} for member={member.id}: {e}')
+                return False
+
+    async def _report(self, message):
+        logger.info(message)
+        channel = self.bot.get_channel(self.debug_channel_id) if self.debug_channel_id else None
+        if channel:
+            try:
+                await channel.send(message)
+            except discord.HTTPException:
+                pass
+
+    async def run(self, guild, role, action, user_ids, description):
+        """
+        Durable bulk job: `action` the role for every user in `user_ids`.
+        """
+        user_ids = set(user_ids)
+        await self.db.add_role_tasks(guild.id, role.id, action, user_ids)
+        # picks up tasks left failed by earlier jobs
+        for task in await self.db.get_role_tasks(guild.id):
+            if task.role_id == role.id and task.action == action:
+                user_ids.add(task.user_id)
+        await self._drain(guild, role.id, action, list(user_ids), description)
+
+    async def resume(self, guild):
+        """Finishes the bulk jobs left in the queue by a previous run"""
+        pending = defaultdict(list)
+        for task in await self.db.get_role_tasks(guild.id):
+            pending[(task.role_id, task.action)].append(task.user_id)
+        for (role_id, action), user_ids in pending.items():
+            await self._drain(guild, role_id, action, user_ids, f'resumed {action} of role {role_id}')
+
+    async def _drain(self, guild, role_id, action, user_ids, description):
+        total = len(user_ids)
+        if total == 0:
+            return
+        role = guild.get_role(role_id)
+        await self.bot.members.ensure(guild, user_ids)
+        done = []
+        completed = 0
+        failed = 0
+        await self._report(f'{description}: {total} members')
+
+        async def process(user_id):
+            nonlocal completed, failed
+            member = guild.get_member(user_id)
+            # gone from the server, or the role was deleted: nothing left to do
+            if member is not None and role is not None:
+                if not await self.apply(member, role, action):
+                    # stays queued for a later retry
+                    failed += 1
+                    return
+            completed += 1
+            done.append(user_id)
+            if len(done) >= CHECKPOINT_EVERY:
+                batch = done[:]
+                done.clear()
+                await self.db.remove_role_tasks(guild.id, role_id, action, batch)
+            if completed % self.progress_every == 0:
+                await self._report(f'{description}: {completed}/{total}')
+
+        await asyncio.gather(*(process(user_id) for user_id in user_ids))
+        if done:
+            await self.db.remove_role_tasks(guild.id, role_id, action, done)
+        message = f'{description}: done, {completed} members'
+        if failed:
+            message = f'{description}: {completed}/{total} members done, {failed} failed and left pending for a retry'
+        await self._report(message)